@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2012  Daniel Kinsman
+# danielkinsman+gss@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#reproducible benchmarks of the game loop. Each scenario runs a headless
+#game from a fixed seed with a scripted player, so the same scenario always
+#simulates the same thing, and reports simulation ticks per second, render
+#frames per second, memory allocated per tick and the per phase timings from
+#game.FrameProfiler. Save a run with --json and pass it back with --baseline
+#to fail when a scenario gets slower. --check plays each scenario with and
+#without batch collisions instead, and fails unless they match exactly.
+#euclid_benchmark.py covers the maths.
+
+import argparse
+import collections
+import json
+import os
+import sys
+
+import pygame
+
+import game
+
+try:
+    import tracemalloc
+except ImportError:
+    #python 2
+    tracemalloc = None
+
+#people on screen at once, spawn cars while there are fewer than carsBelow,
+#carDelay is the average ms between car spawns
+SCENARIOS = [
+    ('shipped', dict(people=1, carsBelow=16, carDelay=1500)),
+    ('busy', dict(people=40, carsBelow=60, carDelay=400)),
+    ('crowd', dict(people=300, carsBelow=200, carDelay=0)),
+]
+
+#phases from the profiler that get their own column
+PHASES = ['carGroup.update', 'personGroup.update', 'runCars', 'runPeople', 'runPlayer', 'spatial']
+
+#the scripted player lets go of people this close to where they are going
+SAFE_DISTANCE = 150
+
+def scriptedButtons(g):
+    #chase the first person still in danger, possess them, walk them most of
+    #the way across and let them go, the way a player would. Returns the
+    #buttons for the next tick, a Game.INPUT_ bitmask.
+    player = g.player
+    if player.host is not None:
+        dy = player.hostGoalY - player.position.y
+        return ((game.Game.INPUT_UP if dy < 0 else 0) |
+                (game.Game.INPUT_DOWN if dy > 0 else 0) |
+                (game.Game.INPUT_POSSESS if abs(dy) < SAFE_DISTANCE else 0))
+
+    for person in g.people:
+        if not person.dead and abs(person.goal.y - person.position.y) > SAFE_DISTANCE:
+            dx = person.position.x - player.position.x
+            dy = person.position.y - player.position.y
+            return ((game.Game.INPUT_LEFT if dx < -5 else 0) |
+                    (game.Game.INPUT_RIGHT if dx > 5 else 0) |
+                    (game.Game.INPUT_UP if dy < -5 else 0) |
+                    (game.Game.INPUT_DOWN if dy > 5 else 0) |
+                    (game.Game.INPUT_POSSESS if abs(dx) < 20 and abs(dy) < 20 else 0))
+
+    return 0
+
+def scriptedInput(g):
+    #the scripted buttons applied straight to the game, for simulate()
+    buttons = scriptedButtons(g)
+    g.steerPlayer(buttons & game.Game.INPUT_LEFT, buttons & game.Game.INPUT_RIGHT,
+                  buttons & game.Game.INPUT_UP, buttons & game.Game.INPUT_DOWN)
+    g.possessToggle = bool(buttons & game.Game.INPUT_POSSESS)
+
+def configure(people, carsBelow, carDelay):
+    #the spawn settings are class constants read at spawn time, so they are
+    #set on Game for the duration of a scenario. Returns the old values.
+    settings = {'SPAWN_CARS_BELOW': carsBelow,
+                'CAR_SPAWN_DELAY_AVERAGE': carDelay,
+                #the load stays put rather than ramping up, and nothing ends
+                'SPAWN_PEOPLE_INCREASE_TIME': sys.maxsize,
+                'DEATHS_TILL_GAME_OVER': sys.maxsize,
+                'SAVES_TILL_WIN': sys.maxsize}
+    old = dict((name, getattr(game.Game, name)) for name in settings)
+    for name, value in settings.items():
+        setattr(game.Game, name, value)
+
+    return old
+
+def newGame(options, seed, people, profile=False):
+    g = game.Game(headless=True, entityStore=options.entityStore, batchCollisions=options.batchCollisions, profile=profile, seed=seed)
+    g.concurrentPeople = people
+    return g
+
+def advance(g, ticks):
+    for tick in range(ticks):
+        scriptedInput(g)
+        g.simulate(1)
+
+def measureTicks(options, settings):
+    g = newGame(options, options.seed, settings['people'], profile=True)
+    advance(g, options.warmup)
+    #only time the measured ticks, and keep all of them for the percentiles
+    g.profiler.frames = collections.deque(maxlen=options.ticks)
+    start = game.timer()
+    advance(g, options.ticks)
+    elapsed = game.timer() - start
+    dead = sum(1 for person in g.people if person.dead)
+    state = {'saved': g.peopleSaved, 'dead': dead, 'people': len(g.people), 'cars': len(g.carGroup)}
+    return options.ticks / elapsed, g.profiler.summary(), state
+
+def measureRender(options, settings):
+    g = newGame(options, options.seed, settings['people'])
+    advance(g, options.warmup)
+    elapsed = 0.0
+    for frame in range(options.frames):
+        advance(g, 1)
+        start = game.timer()
+        g.render()
+        elapsed += game.timer() - start
+
+    return options.frames / elapsed
+
+def measureAllocations(options, settings):
+    #average of the most memory each tick had allocated at once, over what
+    #it started with, and the memory kept per tick once the run is over
+    if tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'):
+        return None, None
+
+    g = newGame(options, options.seed, settings['people'])
+    advance(g, options.warmup)
+    ticks = options.allocTicks
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        transient = 0
+        for tick in range(ticks):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            advance(g, 1)
+            transient += tracemalloc.get_traced_memory()[1] - current
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    return transient / float(ticks), retained / float(ticks)
+
+def runScenario(options, name, settings):
+    old = configure(settings['people'], settings['carsBelow'], settings['carDelay'])
+    try:
+        ticksPerSecond, phases, state = measureTicks(options, settings)
+        framesPerSecond = measureRender(options, settings) if options.frames else None
+        if options.allocTicks:
+            allocated, retained = measureAllocations(options, settings)
+        else:
+            allocated, retained = None, None
+    finally:
+        for setting, value in old.items():
+            setattr(game.Game, setting, value)
+
+    return {'scenario': name,
+            'settings': settings,
+            'ticksPerSecond': ticksPerSecond,
+            'framesPerSecond': framesPerSecond,
+            'allocatedBytesPerTick': allocated,
+            'retainedBytesPerTick': retained,
+            'phases': dict((phase, {'p50': p[50], 'p95': p[95], 'p99': p[99]}) for phase, p in phases.items()),
+            'state': state}
+
+def collisionEvents(g):
+    #which cars are braking and which people are dead, in an order that
+    #doesn't depend on how the sprite groups happen to be ordered
+    cars = sorted((car.position.x, car.position.y, car.velocity.x, car.braking) for car in g.carGroup)
+    dead = [index for index, person in enumerate(g.people) if person.dead]
+    return cars, dead
+
+def checkCollisions(options, name, settings):
+    #collideBatch has to give the same answers as the per sprite checks.
+    #Two games play the same seed and input, one finding collisions with
+    #collideBatch on every tick, and their brake and kill events have to
+    #match tick for tick. On every tick collideBatch on the other game's
+    #sprites also has to find exactly what SpatialGrid.collide and
+    #pygame.sprite.spritecollide find. Returns a list of failures.
+    failures = []
+    old = configure(settings['people'], settings['carsBelow'], settings['carDelay'])
+    oldMinimum = game.Game.BATCH_COLLISIONS_MIN
+    game.Game.BATCH_COLLISIONS_MIN = 0
+    try:
+        plain = newGame(options, options.seed, settings['people'])
+        plain.batchCollisions = False
+        batch = newGame(options, options.seed, settings['people'])
+        batch.batchCollisions = True
+        for tick in range(options.warmup + options.ticks):
+            advance(plain, 1)
+            advance(batch, 1)
+            if collisionEvents(plain) != collisionEvents(batch):
+                failures.append('%s tick %d: brake or kill events differ' % (name, tick))
+                break
+
+            cars = plain.carGroup.sprites()
+            people = plain.personGroup.sprites()
+            ahead, under = game.collideBatch(cars, people)
+            for car in cars:
+                expected = set(plain.personGrid.collide(car.crashPredictor))
+                if set(pygame.sprite.spritecollide(car.crashPredictor, plain.personGroup, False)) != expected or \
+                   set(ahead.get(car, [])) != expected:
+                    failures.append('%s tick %d: people ahead of a car differ' % (name, tick))
+
+            for person in people:
+                expected = set(plain.carGrid.collide(person))
+                if set(pygame.sprite.spritecollide(person, plain.carGroup, False)) != expected or \
+                   set(under.get(person, [])) != expected:
+                    failures.append('%s tick %d: cars on a person differ' % (name, tick))
+
+            if failures:
+                break
+    finally:
+        game.Game.BATCH_COLLISIONS_MIN = oldMinimum
+        for setting, value in old.items():
+            setattr(game.Game, setting, value)
+
+    return failures
+
+def printResults(results):
+    def number(value, format):
+        return format % value if value is not None else 'n/a'
+
+    print('%-10s %10s %10s %12s %12s  %s' % ('scenario', 'ticks/s', 'frames/s', 'alloc/tick', 'kept/tick', 'state'))
+    for result in results:
+        state = result['state']
+        print('%-10s %10.1f %10s %12s %12s  saved %d dead %d people %d cars %d' % (
+            result['scenario'], result['ticksPerSecond'],
+            number(result['framesPerSecond'], '%.1f'),
+            number(result['allocatedBytesPerTick'], '%.0f B'),
+            number(result['retainedBytesPerTick'], '%.0f B'),
+            state['saved'], state['dead'], state['people'], state['cars']))
+
+    print('')
+    print('%-10s' % 'p50/p95 ms' + ''.join(['%20s' % phase for phase in PHASES]))
+    for result in results:
+        phases = result['phases']
+        cells = []
+        for phase in PHASES:
+            if phase in phases:
+                cells.append('%20s' % ('%.3f/%.3f' % (phases[phase]['p50'], phases[phase]['p95'])))
+            else:
+                cells.append('%20s' % '-')
+        print('%-10s' % result['scenario'] + ''.join(cells))
+
+def compareBaseline(results, baseline, tolerance):
+    #returns the scenarios that are more than tolerance slower than baseline
+    previous = dict((result['scenario'], result) for result in baseline['results'])
+    slower = []
+    for result in results:
+        old = previous.get(result['scenario'])
+        if old is None:
+            continue
+
+        change = result['ticksPerSecond'] / old['ticksPerSecond'] - 1.0
+        print('%-10s ticks/s %+.1f%% against baseline' % (result['scenario'], change * 100.0))
+        if change < -tolerance:
+            slower.append(result['scenario'])
+
+    return slower
+
+def main(args):
+    names = [name for name, settings in SCENARIOS]
+    parser = argparse.ArgumentParser(description='Ghost Safety Squad game loop benchmarks')
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO', help='any of %s, default all' % ', '.join(names))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--ticks', type=int, default=2000, help='ticks to time')
+    parser.add_argument('--warmup', type=int, default=500, help='ticks to run first so the load has built up')
+    parser.add_argument('--frames', type=int, default=300, help='frames to render, 0 to skip')
+    parser.add_argument('--alloc-ticks', dest='allocTicks', type=int, default=200, help='ticks to trace allocations for, 0 to skip')
+    parser.add_argument('--people', type=int, help='override concurrent people')
+    parser.add_argument('--cars-below', dest='carsBelow', type=int, help='override SPAWN_CARS_BELOW')
+    parser.add_argument('--car-delay', dest='carDelay', type=int, help='override CAR_SPAWN_DELAY_AVERAGE')
+    parser.add_argument('--entity-store', dest='entityStore', action='store_true')
+    parser.add_argument('--batch-collisions', dest='batchCollisions', action='store_true')
+    parser.add_argument('--json', metavar='FILE', help='also write the results to FILE')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against results saved with --json')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='fraction slower than baseline that fails, default 0.1')
+    parser.add_argument('--check', action='store_true', help='check batch collisions against the per sprite ones instead of timing')
+    options = parser.parse_args(args)
+
+    for name in options.scenarios:
+        if name not in names:
+            parser.error('unknown scenario %s' % name)
+
+    #sprites load their images relative to the game directory
+    os.chdir(os.path.dirname(os.path.abspath(game.__file__)))
+
+    results = []
+    for name, settings in SCENARIOS:
+        if options.scenarios and name not in options.scenarios:
+            continue
+
+        settings = dict(settings)
+        for setting in ('people', 'carsBelow', 'carDelay'):
+            if getattr(options, setting) is not None:
+                settings[setting] = getattr(options, setting)
+
+        if options.check:
+            failures = checkCollisions(options, name, settings)
+            for failure in failures:
+                print('FAIL %s' % failure)
+            print('%-10s %s' % (name, 'failed' if failures else 'ok'))
+            results.extend(failures)
+        else:
+            results.append(runScenario(options, name, settings))
+
+    if options.check:
+        if results:
+            sys.exit(1)
+        return
+
+    printResults(results)
+
+    if options.json:
+        with open(options.json, 'w') as output:
+            json.dump({'seed': options.seed, 'ticks': options.ticks, 'warmup': options.warmup,
+                       'python': sys.version.split()[0], 'results': results}, output, indent=1, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        slower = compareBaseline(results, baseline, options.tolerance)
+        if slower:
+            print('slower than baseline: %s' % ', '.join(slower))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
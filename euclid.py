@@ -25,46 +25,43 @@ Documentation and tests are included in the file "euclid.txt", or online
 at http://code.google.com/p/pyeuclid
 '''
 
+from __future__ import division
+
 __docformat__ = 'restructuredtext'
 __version__ = '$Id: euclid.py 37 2011-08-21 22:24:05Z elfnor@gmail.com $'
 __revision__ = '$Revision: 37 $'
 
 import math
 import operator
-import types
+import os
 
-# Some magic here.  If _use_slots is True, the classes will derive from
-# object and will define a __slots__ class variable.  If _use_slots is
-# False, classes will be old-style and will not define __slots__.
-#
-# _use_slots = True:   Memory efficient, probably faster in future versions
-#                      of Python, "better".
-# _use_slots = False:  Ordinary classes, much faster than slots in current
-#                      versions of Python (2.4 and 2.5).
-_use_slots = True
+# numpy is only needed for the packed array types such as Vector2Array.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    _integer_types = (int, long)
+except NameError:
+    # Python 3
+    _integer_types = (int,)
+_scalar_types = _integer_types + (float,)
 
 # If True, allows components of Vector2 and Vector3 to be set via swizzling;
-# e.g.  v.xyz = (1, 2, 3).  This is much, much slower than the more verbose
-# v.x = 1; v.y = 2; v.z = 3,  and slows down ordinary element setting as
-# well.  Recommended setting is False.
+# e.g.  v.xyz = (1, 2, 3).  Only swizzles without repeated components can be
+# set.  Ordinary element setting is unaffected, as the setters live on the
+# swizzle properties themselves rather than in __setattr__.
 _enable_swizzle_set = False
 
-# Requires class to derive from object.
-if _enable_swizzle_set:
-    _use_slots = True
-
-# Implement _use_slots magic.
+# Every class is a new-style class with __slots__; the metaclass gives the
+# slotted classes pickle support.
 class _EuclidMetaclass(type):
     def __new__(cls, name, bases, dct):
         if '__slots__' in dct:
             dct['__getstate__'] = cls._create_getstate(dct['__slots__'])
             dct['__setstate__'] = cls._create_setstate(dct['__slots__'])
-        if _use_slots:
-            return type.__new__(cls, name, bases + (object,), dct)
-        else:
-            if '__slots__' in dct:
-                del dct['__slots__']
-            return types.ClassType.__new__(types.ClassType, name, bases, dct)
+        return type.__new__(cls, name, bases, dct)
 
     @classmethod
     def _create_getstate(cls, slots):
@@ -82,9 +79,38 @@ class _EuclidMetaclass(type):
                 setattr(self, name, value)
         return __setstate__
 
-__metaclass__ = _EuclidMetaclass
-
-class Vector2:
+# Base for the classes below, applying the metaclass in a way both Python 2
+# and Python 3 accept.
+_EuclidObject = _EuclidMetaclass('_EuclidObject', (object,), {'__slots__': ()})
+
+# Swizzles of two to four components are precomputed as class properties,
+# so that v.yx is an ordinary attribute lookup.  There is deliberately no
+# __getattr__ fallback: merely defining one slows every v.x lookup down
+# threefold on current CPython.
+def _swizzle_setter(name):
+    def __set__(self, value):
+        value = tuple(value)
+        if len(value) != len(name):
+            raise ValueError('%s needs %d components' % (name, len(name)))
+        for c, v in zip(name, value):
+            setattr(self, c, v)
+    return __set__
+
+def _install_swizzles(cls, components):
+    names = ['']
+    for length in (1, 2, 3, 4):
+        names = [n + c for n in names for c in components]
+        if length == 1:
+            continue
+        for name in names:
+            if hasattr(cls, name):
+                continue
+            setter = None
+            if _enable_swizzle_set and len(set(name)) == len(name):
+                setter = _swizzle_setter(name)
+            setattr(cls, name, property(operator.attrgetter(*name), setter))
+
+class Vector2(_EuclidObject):
     __slots__ = ['x', 'y']
     __hash__ = None
 
@@ -112,9 +138,11 @@ class Vector2:
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def __nonzero__(self):
+    def __bool__(self):
         return self.x != 0 or self.y != 0
 
+    __nonzero__ = __bool__
+
     def __len__(self):
         return 2
 
@@ -129,34 +157,17 @@ class Vector2:
     def __iter__(self):
         return iter((self.x, self.y))
 
-    def __getattr__(self, name):
-        try:
-            return tuple([(self.x, self.y)['xy'.index(c)] \
-                          for c in name])
-        except ValueError:
-            raise AttributeError, name
-
-    if _enable_swizzle_set:
-        # This has detrimental performance on ordinary setattr as well
-        # if enabled
-        def __setattr__(self, name, value):
-            if len(name) == 1:
-                object.__setattr__(self, name, value)
-            else:
-                try:
-                    l = [self.x, self.y]
-                    for c, v in map(None, name, value):
-                        l['xy'.index(c)] = v
-                    self.x, self.y = l
-                except ValueError:
-                    raise AttributeError, name
 
     def __add__(self, other):
+        if self.__class__ is Vector2 and other.__class__ is Vector2:
+            # Fast path for the most common case
+            return Vector2(self.x + other.x,
+                           self.y + other.y)
         if isinstance(other, Vector2):
             # Vector + Vector -> Vector
             # Vector + Point -> Point
             # Point + Point -> Vector
-            if self.__class__ is other.__class__:
+            if isinstance(self, Point2) == isinstance(other, Point2):
                 _class = Vector2
             else:
                 _class = Point2
@@ -178,11 +189,14 @@ class Vector2:
         return self
 
     def __sub__(self, other):
+        if self.__class__ is Vector2 and other.__class__ is Vector2:
+            return Vector2(self.x - other.x,
+                           self.y - other.y)
         if isinstance(other, Vector2):
             # Vector - Vector -> Vector
             # Vector - Point -> Point
             # Point - Point -> Vector
-            if self.__class__ is other.__class__:
+            if isinstance(self, Point2) == isinstance(other, Point2):
                 _class = Vector2
             else:
                 _class = Point2
@@ -200,54 +214,47 @@ class Vector2:
                            other.y - self.y)
         else:
             assert hasattr(other, '__len__') and len(other) == 2
-            return Vector2(other.x - self[0],
-                           other.y - self[1])
+            return Vector2(other[0] - self.x,
+                           other[1] - self.y)
 
     def __mul__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector2(self.x * other,
                        self.y * other)
 
     __rmul__ = __mul__
 
     def __imul__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         self.x *= other
         self.y *= other
         return self
 
-    def __div__(self, other):
-        assert type(other) in (int, long, float)
-        return Vector2(operator.div(self.x, other),
-                       operator.div(self.y, other))
-
-
-    def __rdiv__(self, other):
-        assert type(other) in (int, long, float)
-        return Vector2(operator.div(other, self.x),
-                       operator.div(other, self.y))
-
     def __floordiv__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector2(operator.floordiv(self.x, other),
                        operator.floordiv(self.y, other))
 
 
     def __rfloordiv__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector2(operator.floordiv(other, self.x),
                        operator.floordiv(other, self.y))
 
     def __truediv__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector2(operator.truediv(self.x, other),
                        operator.truediv(self.y, other))
 
 
     def __rtruediv__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector2(operator.truediv(other, self.x),
                        operator.truediv(other, self.y))
+
+    # Python 2 spelling; / is always true division
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
     
     def __neg__(self):
         return Vector2(-self.x,
@@ -303,7 +310,269 @@ class Vector2:
         n = other.normalized()
         return self.dot(n)*n
 
-class Vector3:
+    # In place and out parameter variants of the operators above.  These
+    # write their result into an existing vector instead of allocating a
+    # new one, and return the vector written to.
+
+    def set(self, x, y):
+        self.x = x
+        self.y = y
+        return self
+
+    def add_into(self, other, out):
+        '''out = self + other'''
+        out.x = self.x + other.x
+        out.y = self.y + other.y
+        return out
+
+    def sub_into(self, other, out):
+        '''out = self - other'''
+        out.x = self.x - other.x
+        out.y = self.y - other.y
+        return out
+
+    def scale_into(self, scale, out):
+        '''out = self * scale'''
+        out.x = self.x * scale
+        out.y = self.y * scale
+        return out
+
+    def normalize_into(self, out):
+        '''out = self.normalized()'''
+        x = self.x
+        y = self.y
+        d = math.sqrt(x ** 2 + y ** 2)
+        if d:
+            x /= d
+            y /= d
+        out.x = x
+        out.y = y
+        return out
+
+    def add_scaled(self, other, scale):
+        '''self += other * scale'''
+        self.x += other.x * scale
+        self.y += other.y * scale
+        return self
+
+_install_swizzles(Vector2, 'xy')
+
+def _require_numpy(name):
+    if numpy is None:
+        raise ImportError('%s requires numpy' % name)
+
+class Vector2Array(_EuclidObject):
+    '''A packed array of 2D vectors.
+
+    The components are kept in one contiguous ``(n, 2)`` numpy array,
+    `data`, so arithmetic over every vector is a single vectorised
+    operation rather than a Python object per vector.  Indexing with an
+    integer returns a `Vector2View` onto that row; slicing returns a
+    Vector2Array sharing the same storage.
+
+    Operands may be another Vector2Array of the same length, a single
+    Vector2 or pair (applied to every element), or anything numpy will
+    broadcast against ``(n, 2)``.  Scale factors may be a number or one
+    number per vector.
+    '''
+    __slots__ = ['data']
+
+    def __init__(self, vectors=0):
+        _require_numpy('Vector2Array')
+        if isinstance(vectors, _integer_types):
+            self.data = numpy.zeros((vectors, 2))
+        elif isinstance(vectors, numpy.ndarray):
+            # Wrap rather than copy when the array is already suitable
+            self.data = numpy.asarray(vectors, dtype=float)
+            assert self.data.ndim == 2 and self.data.shape[1] == 2
+        else:
+            self.data = numpy.array([(v[0], v[1]) for v in vectors],
+                                    dtype=float).reshape(-1, 2)
+
+    def __copy__(self):
+        return Vector2Array(self.data.copy())
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'Vector2Array([%s])' % \
+            ', '.join(['(%.2f, %.2f)' % (x, y) for x, y in self.data])
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Vector2Array(self.data[key])
+        if key < 0:
+            key += len(self.data)
+        if not 0 <= key < len(self.data):
+            raise IndexError(key)
+        return Vector2View(self.data, key)
+
+    def __setitem__(self, key, value):
+        self.data[key] = _vector2_operand(value)
+
+    def __iter__(self):
+        for index in range(len(self.data)):
+            yield Vector2View(self.data, index)
+
+    def _get_x(self):
+        return self.data[:, 0]
+
+    def _set_x(self, value):
+        self.data[:, 0] = value
+
+    def _get_y(self):
+        return self.data[:, 1]
+
+    def _set_y(self, value):
+        self.data[:, 1] = value
+
+    x = property(_get_x, _set_x,
+                 doc='''Column view of the x components.''')
+    y = property(_get_y, _set_y,
+                 doc='''Column view of the y components.''')
+
+    def __add__(self, other):
+        return Vector2Array(self.data + _vector2_operand(other))
+
+    __radd__ = __add__
+
+    def __iadd__(self, other):
+        self.data += _vector2_operand(other)
+        return self
+
+    def __sub__(self, other):
+        return Vector2Array(self.data - _vector2_operand(other))
+
+    def __rsub__(self, other):
+        return Vector2Array(_vector2_operand(other) - self.data)
+
+    def __isub__(self, other):
+        self.data -= _vector2_operand(other)
+        return self
+
+    def __mul__(self, other):
+        return Vector2Array(self.data * _scale_operand(other))
+
+    __rmul__ = __mul__
+
+    def __imul__(self, other):
+        self.data *= _scale_operand(other)
+        return self
+
+    def __truediv__(self, other):
+        return Vector2Array(self.data / _scale_operand(other))
+
+    __div__ = __truediv__
+
+    def __itruediv__(self, other):
+        self.data /= _scale_operand(other)
+        return self
+
+    __idiv__ = __itruediv__
+
+    def __neg__(self):
+        return Vector2Array(-self.data)
+
+    def magnitude(self):
+        x = self.data[:, 0]
+        y = self.data[:, 1]
+        return numpy.sqrt(x ** 2 + y ** 2)
+
+    __abs__ = magnitude
+
+    def magnitude_squared(self):
+        x = self.data[:, 0]
+        y = self.data[:, 1]
+        return x ** 2 + y ** 2
+
+    def normalize(self):
+        '''Normalize every vector in place.  Zero length vectors are left
+        as they are, as with Vector2.normalize.'''
+        d = self.magnitude()
+        nonzero = d != 0
+        self.data[nonzero] /= d[nonzero, numpy.newaxis]
+        return self
+
+    def normalized(self):
+        return self.copy().normalize()
+
+    def dot(self, other):
+        product = self.data * _vector2_operand(other)
+        return product[:, 0] + product[:, 1]
+
+    def angle(self, other):
+        '''Return the angle of each vector to other, in radians.  The angle
+        is nan where either vector has zero length.'''
+        if isinstance(other, Vector2Array):
+            other_magnitude = other.magnitude()
+        elif isinstance(other, Vector2):
+            other_magnitude = other.magnitude()
+        else:
+            other_magnitude = Vector2Array(
+                numpy.broadcast_to(_vector2_operand(other),
+                                   self.data.shape)).magnitude()
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.arccos(self.dot(other) /
+                                (self.magnitude() * other_magnitude))
+
+    def add_scaled(self, other, scale):
+        '''self += other * scale, in place, without a temporary
+        Vector2Array.'''
+        self.data += _vector2_operand(other) * _scale_operand(scale)
+        return self
+
+def _vector2_operand(other):
+    if isinstance(other, Vector2Array):
+        return other.data
+    if isinstance(other, Vector2):
+        return numpy.array((other.x, other.y))
+    return numpy.asarray(other, dtype=float)
+
+def _scale_operand(scale):
+    # One factor per vector has to be lined up with the rows
+    if isinstance(scale, numpy.ndarray) and scale.ndim == 1:
+        return scale[:, numpy.newaxis]
+    return scale
+
+class Vector2View(Vector2):
+    '''A Vector2 whose components are a row of a Vector2Array.
+
+    Reading or writing ``x`` and ``y`` goes straight to the array, so the
+    view can be handed to code expecting a Vector2.  `array` and `index`
+    may be reassigned to move the view to different storage.  Arithmetic
+    returns ordinary Vector2 instances.
+    '''
+    __slots__ = ['array', 'index']
+
+    def __init__(self, array, index):
+        self.array = array
+        self.index = index
+
+    def __copy__(self):
+        return Vector2(self.x, self.y)
+
+    copy = __copy__
+    __pos__ = __copy__
+
+    def _get_x(self):
+        return float(self.array[self.index, 0])
+
+    def _set_x(self, value):
+        self.array[self.index, 0] = value
+
+    def _get_y(self):
+        return float(self.array[self.index, 1])
+
+    def _set_y(self, value):
+        self.array[self.index, 1] = value
+
+    x = property(_get_x, _set_x)
+    y = property(_get_y, _set_y)
+
+class Vector3(_EuclidObject):
     __slots__ = ['x', 'y', 'z']
     __hash__ = None
 
@@ -336,9 +605,11 @@ class Vector3:
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def __nonzero__(self):
+    def __bool__(self):
         return self.x != 0 or self.y != 0 or self.z != 0
 
+    __nonzero__ = __bool__
+
     def __len__(self):
         return 3
 
@@ -353,27 +624,6 @@ class Vector3:
     def __iter__(self):
         return iter((self.x, self.y, self.z))
 
-    def __getattr__(self, name):
-        try:
-            return tuple([(self.x, self.y, self.z)['xyz'.index(c)] \
-                          for c in name])
-        except ValueError:
-            raise AttributeError, name
-
-    if _enable_swizzle_set:
-        # This has detrimental performance on ordinary setattr as well
-        # if enabled
-        def __setattr__(self, name, value):
-            if len(name) == 1:
-                object.__setattr__(self, name, value)
-            else:
-                try:
-                    l = [self.x, self.y, self.z]
-                    for c, v in map(None, name, value):
-                        l['xyz'.index(c)] = v
-                    self.x, self.y, self.z = l
-                except ValueError:
-                    raise AttributeError, name
 
 
     def __add__(self, other):
@@ -381,7 +631,7 @@ class Vector3:
             # Vector + Vector -> Vector
             # Vector + Point -> Point
             # Point + Point -> Vector
-            if self.__class__ is other.__class__:
+            if isinstance(self, Point3) == isinstance(other, Point3):
                 _class = Vector3
             else:
                 _class = Point3
@@ -411,13 +661,13 @@ class Vector3:
             # Vector - Vector -> Vector
             # Vector - Point -> Point
             # Point - Point -> Vector
-            if self.__class__ is other.__class__:
+            if isinstance(self, Point3) == isinstance(other, Point3):
                 _class = Vector3
             else:
                 _class = Point3
-            return Vector3(self.x - other.x,
-                           self.y - other.y,
-                           self.z - other.z)
+            return _class(self.x - other.x,
+                          self.y - other.y,
+                          self.z - other.z)
         else:
             assert hasattr(other, '__len__') and len(other) == 3
             return Vector3(self.x - other[0],
@@ -432,9 +682,9 @@ class Vector3:
                            other.z - self.z)
         else:
             assert hasattr(other, '__len__') and len(other) == 3
-            return Vector3(other.x - self[0],
-                           other.y - self[1],
-                           other.z - self[2])
+            return Vector3(other[0] - self.x,
+                           other[1] - self.y,
+                           other[2] - self.z)
 
     def __mul__(self, other):
         if isinstance(other, Vector3):
@@ -447,7 +697,7 @@ class Vector3:
                           self.y * other.y,
                           self.z * other.z)
         else: 
-            assert type(other) in (int, long, float)
+            assert type(other) in _scalar_types
             return Vector3(self.x * other,
                            self.y * other,
                            self.z * other)
@@ -455,50 +705,41 @@ class Vector3:
     __rmul__ = __mul__
 
     def __imul__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         self.x *= other
         self.y *= other
         self.z *= other
         return self
 
-    def __div__(self, other):
-        assert type(other) in (int, long, float)
-        return Vector3(operator.div(self.x, other),
-                       operator.div(self.y, other),
-                       operator.div(self.z, other))
-
-
-    def __rdiv__(self, other):
-        assert type(other) in (int, long, float)
-        return Vector3(operator.div(other, self.x),
-                       operator.div(other, self.y),
-                       operator.div(other, self.z))
-
     def __floordiv__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector3(operator.floordiv(self.x, other),
                        operator.floordiv(self.y, other),
                        operator.floordiv(self.z, other))
 
 
     def __rfloordiv__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector3(operator.floordiv(other, self.x),
                        operator.floordiv(other, self.y),
                        operator.floordiv(other, self.z))
 
     def __truediv__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector3(operator.truediv(self.x, other),
                        operator.truediv(self.y, other),
                        operator.truediv(self.z, other))
 
 
     def __rtruediv__(self, other):
-        assert type(other) in (int, long, float)
+        assert type(other) in _scalar_types
         return Vector3(operator.truediv(other, self.x),
                        operator.truediv(other, self.y),
                        operator.truediv(other, self.z))
+
+    # Python 2 spelling; / is always true division
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
     
     def __neg__(self):
         return Vector3(-self.x,
@@ -582,11 +823,13 @@ class Vector3:
         n = other.normalized()
         return self.dot(n)*n
 
+_install_swizzles(Vector3, 'xyz')
+
 # a b c 
 # e f g 
 # i j k 
 
-class Matrix3:
+class Matrix3(_EuclidObject):
     __slots__ = list('abcefgijk')
 
     def __init__(self):
@@ -787,12 +1030,35 @@ class Matrix3:
 
             return tmp
 
+    # Batch operations, see batch_transform_points
+    def to_array(self):
+        '''Return the matrix as a row-major 3x3 numpy array.'''
+        _require_numpy('Matrix3.to_array')
+        return numpy.array([[self.a, self.b, self.c],
+                            [self.e, self.f, self.g],
+                            [self.i, self.j, self.k]], dtype=float)
+
+    def from_array(cls, array):
+        _require_numpy('Matrix3.from_array')
+        M = cls()
+        (M.a, M.b, M.c,
+         M.e, M.f, M.g,
+         M.i, M.j, M.k) = [float(v) for v in numpy.ravel(array)]
+        return M
+    from_array = classmethod(from_array)
+
+    def transform_points(self, points):
+        return batch_transform_points(self, points)
+
+    def transform_vectors(self, vectors):
+        return batch_transform_vectors(self, vectors)
+
 # a b c d
 # e f g h
 # i j k l
 # m n o p
 
-class Matrix4:
+class Matrix4(_EuclidObject):
     __slots__ = list('abcdefghijklmnop')
 
     def __init__(self):
@@ -1223,9 +1489,119 @@ class Matrix4:
             tmp.p = d * (self.a * (self.f * self.k - self.j * self.g) + self.e * (self.j * self.c - self.b * self.k) + self.i * (self.b * self.g - self.f * self.c));
 
         return tmp;
-        
 
-class Quaternion:
+    # Batch operations, see batch_transform_points
+    def to_array(self):
+        '''Return the matrix as a row-major 4x4 numpy array.'''
+        _require_numpy('Matrix4.to_array')
+        return numpy.array([[self.a, self.b, self.c, self.d],
+                            [self.e, self.f, self.g, self.h],
+                            [self.i, self.j, self.k, self.l],
+                            [self.m, self.n, self.o, self.p]], dtype=float)
+
+    def from_array(cls, array):
+        _require_numpy('Matrix4.from_array')
+        M = cls()
+        (M.a, M.b, M.c, M.d,
+         M.e, M.f, M.g, M.h,
+         M.i, M.j, M.k, M.l,
+         M.m, M.n, M.o, M.p) = [float(v) for v in numpy.ravel(array)]
+        return M
+    from_array = classmethod(from_array)
+
+    def transform_points(self, points):
+        return batch_transform_points(self, points)
+
+    def transform_vectors(self, vectors):
+        return batch_transform_vectors(self, vectors)
+
+    def project_points(self, points):
+        return batch_project_points(self, points)
+
+# Batch matrix operations.  These work on numpy arrays so that a transform
+# (or a stack of transforms) is applied to many points in one call, instead
+# of one Point2/Point3 at a time.
+#
+# Matrices may be a Matrix3/Matrix4, a sequence of them, or a row-major
+# numpy array of shape (3, 3)/(4, 4) or (m, 3, 3)/(m, 4, 4).  Points are an
+# (n, 2) array for Matrix3 or (n, 3) for Matrix4; a Vector2Array or a
+# sequence of vectors is also accepted.  Shapes broadcast the way numpy
+# does: one matrix and (n, d) points gives (n, d); m matrices and (n, d)
+# points gives (m, n, d), every point under every matrix; m matrices and
+# (m, n, d) points pairs each matrix with its own n points.
+
+def matrix_array(matrices):
+    '''Return matrices as a row-major numpy array of shape (..., s, s).'''
+    _require_numpy('matrix_array')
+    if isinstance(matrices, (Matrix3, Matrix4)):
+        return matrices.to_array()
+    if isinstance(matrices, numpy.ndarray):
+        array = numpy.asarray(matrices, dtype=float)
+    else:
+        array = numpy.array([m.to_array()
+                             if isinstance(m, (Matrix3, Matrix4)) else m
+                             for m in matrices], dtype=float)
+    if array.ndim < 2 or array.shape[-1] != array.shape[-2] or \
+       array.shape[-1] not in (3, 4):
+        raise ValueError('expected 3x3 or 4x4 matrices, got shape %s' % \
+                         (array.shape,))
+    return array
+
+def _point_array(points, matrices):
+    if isinstance(points, Vector2Array):
+        points = points.data
+    elif not isinstance(points, numpy.ndarray):
+        points = [tuple(p) for p in points]
+    points = numpy.asarray(points, dtype=float)
+    if points.shape[-1] != matrices.shape[-1] - 1:
+        raise ValueError('%dx%d matrices transform %d component points' % \
+                         (matrices.shape[-1], matrices.shape[-1],
+                          matrices.shape[-1] - 1))
+    return points
+
+def _batch_transform(matrices, points, translate, project):
+    M = matrix_array(matrices)
+    P = _point_array(points, M)
+    d = M.shape[-1] - 1
+    out = numpy.einsum('...ij,...kj->...ki', M[..., :d, :d], P)
+    if translate:
+        out += M[..., numpy.newaxis, :d, d]
+    if project:
+        w = numpy.einsum('...j,...kj->...k', M[..., d, :d], P) + \
+            M[..., d, d, numpy.newaxis]
+        # Matches Matrix4.transform, which leaves points with w == 0 alone
+        w[w == 0] = 1
+        out /= w[..., numpy.newaxis]
+    if isinstance(points, Vector2Array) and out.ndim == 2:
+        return Vector2Array(out)
+    return out
+
+def batch_transform_points(matrices, points):
+    '''Transform points, including translation; as Matrix * Point2/Point3.
+    
+    Returns a numpy array, or a Vector2Array if given one and there is a
+    single matrix.
+    '''
+    return _batch_transform(matrices, points, True, False)
+
+def batch_transform_vectors(matrices, vectors):
+    '''Transform vectors, ignoring translation; as Matrix * Vector2/Vector3.'''
+    return _batch_transform(matrices, vectors, False, False)
+
+def batch_project_points(matrices, points):
+    '''Transform points with the perspective divide of Matrix4.transform.'''
+    return _batch_transform(matrices, points, True, True)
+
+def batch_compose(a, b):
+    '''Return the products a * b of two matrix stacks, broadcasting.
+    
+    Either side may be a single matrix, so ``batch_compose(camera, world)``
+    combines one camera matrix with every world matrix in the stack.
+    '''
+    return numpy.matmul(matrix_array(a), matrix_array(b))
+
+
+class Quaternion(_EuclidObject):
     # All methods and naming conventions based off 
     # http://www.euclideanspace.com/maths/algebra/realNormedAlgebra/quaternions
 
@@ -1550,18 +1926,507 @@ class Quaternion:
         return Q
     new_interpolate = classmethod(new_interpolate)
 
+    # Batch operations, see batch_quaternion_interpolate
+    def to_array(self):
+        '''Return the quaternion as a numpy array (w, x, y, z).'''
+        _require_numpy('Quaternion.to_array')
+        return numpy.array([self.w, self.x, self.y, self.z], dtype=float)
+
+    def from_array(cls, array):
+        w, x, y, z = [float(v) for v in array]
+        return cls(w, x, y, z)
+    from_array = classmethod(from_array)
+
+# Batch quaternion operations.  Quaternions are held as (n, 4) numpy arrays
+# of (w, x, y, z) rows, so hundreds of rotations can be normalised,
+# interpolated or turned into matrices in one call.  Each function gives
+# the same result per row as the corresponding Quaternion method.
+
+def quaternion_array(quaternions):
+    '''Return quaternions as an (n, 4) numpy array of (w, x, y, z).'''
+    _require_numpy('quaternion_array')
+    if isinstance(quaternions, numpy.ndarray):
+        array = numpy.asarray(quaternions, dtype=float)
+    else:
+        array = numpy.array([(q.w, q.x, q.y, q.z)
+                             if isinstance(q, Quaternion) else q
+                             for q in quaternions], dtype=float)
+    if array.shape[-1] != 4:
+        raise ValueError('expected (w, x, y, z) rows, got shape %s' % \
+                         (array.shape,))
+    return array
+
+def batch_quaternion_normalize(quaternions):
+    '''Return unit copies of quaternions, leaving zero rows alone.'''
+    Q = quaternion_array(quaternions)
+    d = numpy.sqrt(numpy.einsum('...i,...i->...', Q, Q))
+    d[d == 0] = 1
+    return Q / d[..., numpy.newaxis]
+
+def batch_quaternion_interpolate(q1, q2, t):
+    '''Slerp from each row of q1 to the same row of q2.
+    
+    t may be a single number or one per row.  Matches
+    Quaternion.new_interpolate row for row, including its handling of
+    nearly equal and opposite quaternions.
+    '''
+    Q1 = quaternion_array(q1)
+    Q2 = quaternion_array(q2)
+    t = numpy.asarray(t, dtype=float)[..., numpy.newaxis]
+
+    costheta = numpy.einsum('...i,...i->...', Q1, Q2)
+    flip = costheta < 0
+    if flip.any():
+        # new_interpolate takes the conjugate of q1 in this case
+        Q1 = numpy.where(flip[..., numpy.newaxis],
+                         Q1 * [1., -1., -1., -1.], Q1)
+    costheta = numpy.minimum(numpy.abs(costheta), 1)
+
+    theta = numpy.arccos(costheta)
+    sintheta = numpy.sqrt(1.0 - costheta * costheta)
+    # Guard the division; those rows are replaced below anyway
+    safe = numpy.where(numpy.abs(sintheta) < 0.01, 1, sintheta)
+    ratio1 = (numpy.sin((1 - t) * theta[..., numpy.newaxis]) /
+              safe[..., numpy.newaxis])
+    ratio2 = (numpy.sin(t * theta[..., numpy.newaxis]) /
+              safe[..., numpy.newaxis])
+    out = Q1 * ratio1 + Q2 * ratio2
+
+    halfway = (numpy.abs(sintheta) < 0.01)[..., numpy.newaxis]
+    out = numpy.where(halfway, (Q1 + Q2) * 0.5, out)
+    close = (numpy.abs(theta) < 0.01)[..., numpy.newaxis]
+    return numpy.where(close, Q2, out)
+
+def batch_quaternion_matrix(quaternions):
+    '''Return the rotation matrix of each quaternion, as get_matrix does.
+    
+    The result is an (n, 4, 4) row-major array, ready for
+    batch_transform_points or batch_compose.
+    '''
+    Q = quaternion_array(quaternions)
+    w, x, y, z = Q[..., 0], Q[..., 1], Q[..., 2], Q[..., 3]
+    xx = x * x
+    xy = x * y
+    xz = x * z
+    xw = x * w
+    yy = y * y
+    yz = y * z
+    yw = y * w
+    zz = z * z
+    zw = z * w
+    M = numpy.zeros(Q.shape[:-1] + (4, 4))
+    M[..., 0, 0] = 1 - 2 * (yy + zz)
+    M[..., 0, 1] = 2 * (xy - zw)
+    M[..., 0, 2] = 2 * (xz + yw)
+    M[..., 1, 0] = 2 * (xy + zw)
+    M[..., 1, 1] = 1 - 2 * (xx + zz)
+    M[..., 1, 2] = 2 * (yz - xw)
+    M[..., 2, 0] = 2 * (xz - yw)
+    M[..., 2, 1] = 2 * (yz + xw)
+    M[..., 2, 2] = 1 - 2 * (xx + yy)
+    M[..., 3, 3] = 1
+    return M
+
+# NumPy backend
+# ---------------------------------------------------------------------------
+#
+# Drop-in versions of Vector2, Vector3, Matrix3, Matrix4 and Quaternion that
+# keep their components in a small numpy array, `_a`, and do their
+# arithmetic with numpy.  They subclass the scalar classes and expose the
+# same attributes through properties, so everything they do not override
+# still works.  Select them by setting EUCLID_BACKEND=numpy before euclid is
+# first imported; see the end of this section.  They rely on the public
+# names pointing at them, so only use them as the active backend.
+
+class _BackendMetaclass(_EuclidMetaclass):
+    # Objects of the scalar class, such as a Vector2View, still count as a
+    # Vector2 when Vector2 names the numpy class
+    def __instancecheck__(cls, instance):
+        scalar = cls.__dict__.get('_scalar')
+        if scalar is not None and isinstance(instance, scalar):
+            return True
+        return type.__instancecheck__(cls, instance)
+
+_BackendObject = _BackendMetaclass('_BackendObject', (_EuclidObject,),
+                                   {'__slots__': ()})
+
+def _array_component(index):
+    def get(self):
+        return float(self._a[index])
+    def set(self, value):
+        self._a[index] = value
+    return property(get, set)
+
+def _backend_operand(other):
+    a = getattr(other, '_a', None)
+    if a is None:
+        return numpy.array(tuple(other), dtype=float)
+    return a
+
+def _backend_matrix(other):
+    a = getattr(other, '_a', None)
+    if a is None:
+        return other.to_array()
+    return a
+
+class _NumpyVector(_BackendObject):
+    '''Methods shared by the numpy Vector2 and Vector3.'''
+    __slots__ = ()
+
+    def _wrap(cls, a):
+        v = cls.__new__(cls)
+        v._a = a
+        return v
+    _wrap = classmethod(_wrap)
+
+    def __copy__(self):
+        return self._wrap(self._a.copy())
+
+    copy = __copy__
+    __pos__ = __copy__
+
+    def __array__(self, dtype=None):
+        return numpy.array(self._a, dtype=dtype)
+
+    def __getitem__(self, key):
+        return self._a.tolist()[key]
+
+    def __setitem__(self, key, value):
+        self._a[key] = value
+
+    def __iter__(self):
+        return iter(self._a.tolist())
+
+    def __bool__(self):
+        return bool(self._a.any())
+
+    __nonzero__ = __bool__
+
+    def __iadd__(self, other):
+        self._a += _backend_operand(other)
+        return self
+
+    def __imul__(self, other):
+        assert type(other) in _scalar_types
+        self._a *= other
+        return self
+
+    def __abs__(self):
+        return math.sqrt(self._a.dot(self._a))
+
+    magnitude = __abs__
+
+    def magnitude_squared(self):
+        return float(self._a.dot(self._a))
+
+    def normalize(self):
+        d = self.magnitude()
+        if d:
+            self._a /= d
+        return self
+
+    def normalized(self):
+        return self.copy().normalize()
+
+    def dot(self, other):
+        return float(self._a.dot(_backend_operand(other)))
+
+    def add_scaled(self, other, scale):
+        self._a += _backend_operand(other) * scale
+        return self
+
+class _NumpyVector2(_NumpyVector, Vector2):
+    __slots__ = ['_a']
+    _scalar = Vector2
+
+    def __init__(self, x=0, y=0):
+        self._a = numpy.array((x, y), dtype=float)
+
+    x = _array_component(0)
+    y = _array_component(1)
+
+    def __add__(self, other):
+        if isinstance(other, Vector2):
+            if isinstance(self, Point2) == isinstance(other, Point2):
+                _class = Vector2
+            else:
+                _class = Point2
+        else:
+            assert hasattr(other, '__len__') and len(other) == 2
+            _class = Vector2
+        return _class._wrap(self._a + _backend_operand(other))
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Vector2):
+            if isinstance(self, Point2) == isinstance(other, Point2):
+                _class = Vector2
+            else:
+                _class = Point2
+        else:
+            assert hasattr(other, '__len__') and len(other) == 2
+            _class = Vector2
+        return _class._wrap(self._a - _backend_operand(other))
+
+    def __rsub__(self, other):
+        return Vector2._wrap(_backend_operand(other) - self._a)
+
+    def __mul__(self, other):
+        assert type(other) in _scalar_types
+        return Vector2._wrap(self._a * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        assert type(other) in _scalar_types
+        return Vector2._wrap(self._a / other)
+
+    __div__ = __truediv__
+
+    def __neg__(self):
+        return Vector2._wrap(-self._a)
+
+class _NumpyVector3(_NumpyVector, Vector3):
+    __slots__ = ['_a']
+    _scalar = Vector3
+
+    def __init__(self, x=0, y=0, z=0):
+        self._a = numpy.array((x, y, z), dtype=float)
+
+    x = _array_component(0)
+    y = _array_component(1)
+    z = _array_component(2)
+
+    def __add__(self, other):
+        if isinstance(other, Vector3):
+            if isinstance(self, Point3) == isinstance(other, Point3):
+                _class = Vector3
+            else:
+                _class = Point3
+        else:
+            assert hasattr(other, '__len__') and len(other) == 3
+            _class = Vector3
+        return _class._wrap(self._a + _backend_operand(other))
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Vector3):
+            if isinstance(self, Point3) == isinstance(other, Point3):
+                _class = Vector3
+            else:
+                _class = Point3
+        else:
+            assert hasattr(other, '__len__') and len(other) == 3
+            _class = Vector3
+        return _class._wrap(self._a - _backend_operand(other))
+
+    def __rsub__(self, other):
+        return Vector3._wrap(_backend_operand(other) - self._a)
+
+    def __mul__(self, other):
+        if isinstance(other, Vector3):
+            if self.__class__ is Point3 or other.__class__ is Point3:
+                _class = Point3
+            else:
+                _class = Vector3
+            return _class._wrap(self._a * _backend_operand(other))
+        assert type(other) in _scalar_types
+        return Vector3._wrap(self._a * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        assert type(other) in _scalar_types
+        return Vector3._wrap(self._a / other)
+
+    __div__ = __truediv__
+
+    def __neg__(self):
+        return Vector3._wrap(-self._a)
+
+class _NumpyMatrix(_BackendObject):
+    '''Methods shared by the numpy Matrix3 and Matrix4.'''
+    __slots__ = ()
+
+    def _wrap(cls, a):
+        M = cls.__new__(cls)
+        M._a = a
+        return M
+    _wrap = classmethod(_wrap)
+
+    def __init__(self):
+        self._a = numpy.identity(self._size)
+
+    def __copy__(self):
+        return self._wrap(self._a.copy())
+
+    copy = __copy__
+
+    def __array__(self, dtype=None):
+        return numpy.array(self._a, dtype=dtype)
+
+    def __getitem__(self, key):
+        # Column major, as the scalar classes
+        return self._a.T.ravel().tolist()[key]
+
+    def __imul__(self, other):
+        assert isinstance(other, self._scalar)
+        self._a = self._a.dot(_backend_matrix(other))
+        return self
+
+    def identity(self):
+        self._a = numpy.identity(self._size)
+        return self
+
+    def determinant(self):
+        return float(numpy.linalg.det(self._a))
+
+    def inverse(self):
+        if abs(self.determinant()) < 0.001:
+            # No inverse, return identity
+            return self.__class__()
+        return self._wrap(numpy.linalg.inv(self._a))
+
+    def to_array(self):
+        return self._a.copy()
+
+class _NumpyMatrix3(_NumpyMatrix, Matrix3):
+    __slots__ = ['_a']
+    _scalar = Matrix3
+    _size = 3
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix3):
+            return Matrix3._wrap(self._a.dot(_backend_matrix(other)))
+        elif isinstance(other, Point2):
+            return Point2._wrap(self._a[:2, :2].dot(_backend_operand(other)) +
+                                self._a[:2, 2])
+        elif isinstance(other, Vector2):
+            return Vector2._wrap(self._a[:2, :2].dot(_backend_operand(other)))
+        return Matrix3.__mul__(self, other)
+
+for _index, _name in enumerate('abcefgijk'):
+    setattr(_NumpyMatrix3, _name, _array_component(divmod(_index, 3)))
+
+class _NumpyMatrix4(_NumpyMatrix, Matrix4):
+    __slots__ = ['_a']
+    _scalar = Matrix4
+    _size = 4
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix4):
+            return Matrix4._wrap(self._a.dot(_backend_matrix(other)))
+        elif isinstance(other, Point3):
+            return Point3._wrap(self._a[:3, :3].dot(_backend_operand(other)) +
+                                self._a[:3, 3])
+        elif isinstance(other, Vector3):
+            return Vector3._wrap(self._a[:3, :3].dot(_backend_operand(other)))
+        return Matrix4.__mul__(self, other)
+
+    def transform(self, other):
+        h = self._a.dot(numpy.append(_backend_operand(other), 1.0))
+        if h[3] != 0:
+            h[:3] /= h[3]
+        return Point3._wrap(h[:3])
+
+    def transpose(self):
+        self._a = self._a.T.copy()
+
+    def transposed(self):
+        return self._wrap(self._a.T.copy())
+
+for _index, _name in enumerate('abcdefghijklmnop'):
+    setattr(_NumpyMatrix4, _name, _array_component(divmod(_index, 4)))
+
+class _NumpyQuaternion(_BackendObject, Quaternion):
+    __slots__ = ['_a']
+    _scalar = Quaternion
+
+    def _wrap(cls, a):
+        Q = cls.__new__(cls)
+        Q._a = a
+        return Q
+    _wrap = classmethod(_wrap)
+
+    def __init__(self, w=1, x=0, y=0, z=0):
+        self._a = numpy.array((w, x, y, z), dtype=float)
+
+    w = _array_component(0)
+    x = _array_component(1)
+    y = _array_component(2)
+    z = _array_component(3)
+
+    def __copy__(self):
+        return self._wrap(self._a.copy())
+
+    copy = __copy__
+
+    def __array__(self, dtype=None):
+        return numpy.array(self._a, dtype=dtype)
+
+    def __abs__(self):
+        return math.sqrt(self._a.dot(self._a))
+
+    magnitude = __abs__
+
+    def magnitude_squared(self):
+        return float(self._a.dot(self._a))
+
+    def identity(self):
+        self._a = numpy.array((1., 0., 0., 0.))
+        return self
+
+    def conjugated(self):
+        return self._wrap(self._a * (1., -1., -1., -1.))
+
+    def normalize(self):
+        d = self.magnitude()
+        if d != 0:
+            self._a /= d
+        return self
+
+    def normalized(self):
+        return self.copy().normalize()
+
+    def get_matrix(self):
+        return Matrix4._wrap(batch_quaternion_matrix(self._a))
+
+    def to_array(self):
+        return self._a.copy()
+
+# Backend selection.  The scalar classes stay available under these names
+# whichever backend is active.
+ScalarVector2 = Vector2
+ScalarVector3 = Vector3
+ScalarMatrix3 = Matrix3
+ScalarMatrix4 = Matrix4
+ScalarQuaternion = Quaternion
+
+backend = os.environ.get('EUCLID_BACKEND', 'python').lower()
+if backend == 'numpy':
+    _require_numpy('EUCLID_BACKEND=numpy')
+    # Rebound before the geometry classes below subclass them
+    Vector2 = _NumpyVector2
+    Vector3 = _NumpyVector3
+    Matrix3 = _NumpyMatrix3
+    Matrix4 = _NumpyMatrix4
+    Quaternion = _NumpyQuaternion
+elif backend != 'python':
+    raise ImportError('unknown EUCLID_BACKEND %r, expected python or numpy' % \
+                      backend)
+
 # Geometry
 # Much maths thanks to Paul Bourke, http://astronomy.swin.edu.au/~pbourke
 # ---------------------------------------------------------------------------
 
-class Geometry:
+class Geometry(_EuclidObject):
     def _connect_unimplemented(self, other):
-        raise AttributeError, 'Cannot connect %s to %s' % \
-            (self.__class__, other.__class__)
+        raise AttributeError('Cannot connect %s to %s' % \
+            (self.__class__, other.__class__))
 
     def _intersect_unimplemented(self, other):
-        raise AttributeError, 'Cannot intersect %s and %s' % \
-            (self.__class__, other.__class__)
+        raise AttributeError('Cannot intersect %s and %s' % \
+            (self.__class__, other.__class__))
 
     _intersect_point2 = _intersect_unimplemented
     _intersect_line2 = _intersect_unimplemented
@@ -1752,18 +2617,18 @@ class Line2(Geometry):
                 self.p = args[0].copy()
                 self.v = args[1].copy()
             else:
-                raise AttributeError, '%r' % (args,)
+                raise AttributeError('%r' % (args,))
         elif len(args) == 1:
             if isinstance(args[0], Line2):
                 self.p = args[0].p.copy()
                 self.v = args[0].v.copy()
             else:
-                raise AttributeError, '%r' % (args,)
+                raise AttributeError('%r' % (args,))
         else:
-            raise AttributeError, '%r' % (args,)
+            raise AttributeError('%r' % (args,))
         
         if not self.v:
-            raise AttributeError, 'Line has zero-length vector'
+            raise AttributeError('Line has zero-length vector')
 
     def __copy__(self):
         return self.__class__(self.p, self.v)
@@ -1782,6 +2647,9 @@ class Line2(Geometry):
         self.p = t * self.p
         self.v = t * self.v
 
+    # Range of u covered by the line, for the batch intersection functions
+    _u_range = (-float('inf'), float('inf'))
+
     def _u_in(self, u):
         return True
 
@@ -1811,6 +2679,8 @@ class Ray2(Line2):
         return 'Ray2(<%.2f, %.2f> + u<%.2f, %.2f>)' % \
             (self.p.x, self.p.y, self.v.x, self.v.y)
 
+    _u_range = (0.0, float('inf'))
+
     def _u_in(self, u):
         return u >= 0.0
 
@@ -1819,6 +2689,8 @@ class LineSegment2(Line2):
         return 'LineSegment2(<%.2f, %.2f> to <%.2f, %.2f>)' % \
             (self.p.x, self.p.y, self.p.x + self.v.x, self.p.y + self.v.y)
 
+    _u_range = (0.0, 1.0)
+
     def _u_in(self, u):
         return u >= 0.0 and u <= 1.0
 
@@ -2092,7 +2964,7 @@ class Point3(Vector3, Geometry):
         if c:
             return c._swap()
 
-class Line3:
+class Line3(_EuclidObject):
     __slots__ = ['p', 'v']
 
     def __init__(self, *args):
@@ -2110,19 +2982,19 @@ class Line3:
                 self.p = args[0].copy()
                 self.v = args[1].copy()
             else:
-                raise AttributeError, '%r' % (args,)
+                raise AttributeError('%r' % (args,))
         elif len(args) == 1:
             if isinstance(args[0], Line3):
                 self.p = args[0].p.copy()
                 self.v = args[0].v.copy()
             else:
-                raise AttributeError, '%r' % (args,)
+                raise AttributeError('%r' % (args,))
         else:
-            raise AttributeError, '%r' % (args,)
+            raise AttributeError('%r' % (args,))
         
         # XXX This is annoying.
         #if not self.v:
-        #    raise AttributeError, 'Line has zero-length vector'
+        #    raise AttributeError('Line has zero-length vector')
 
     def __copy__(self):
         return self.__class__(self.p, self.v)
@@ -2142,6 +3014,9 @@ class Line3:
         self.p = t * self.p
         self.v = t * self.v
 
+    # Range of u covered by the line, for the batch intersection functions
+    _u_range = (-float('inf'), float('inf'))
+
     def _u_in(self, u):
         return True
 
@@ -2176,6 +3051,8 @@ class Ray3(Line3):
         return 'Ray3(<%.2f, %.2f, %.2f> + u<%.2f, %.2f, %.2f>)' % \
             (self.p.x, self.p.y, self.p.z, self.v.x, self.v.y, self.v.z)
 
+    _u_range = (0.0, float('inf'))
+
     def _u_in(self, u):
         return u >= 0.0
 
@@ -2185,6 +3062,8 @@ class LineSegment3(Line3):
             (self.p.x, self.p.y, self.p.z,
              self.p.x + self.v.x, self.p.y + self.v.y, self.p.z + self.v.z)
 
+    _u_range = (0.0, 1.0)
+
     def _u_in(self, u):
         return u >= 0.0 and u <= 1.0
 
@@ -2202,7 +3081,7 @@ class LineSegment3(Line3):
 
     length = property(lambda self: abs(self.v))
 
-class Sphere:
+class Sphere(_EuclidObject):
     __slots__ = ['c', 'r']
 
     def __init__(self, center, radius):
@@ -2250,7 +3129,7 @@ class Sphere:
         if c:
             return c
 
-class Plane:
+class Plane(_EuclidObject):
     # n.p = k, where n is normal, p is point on plane, k is constant scalar
     __slots__ = ['n', 'k']
 
@@ -2270,13 +3149,13 @@ class Plane:
                 self.n = args[0].normalized()
                 self.k = args[1]
             else:
-                raise AttributeError, '%r' % (args,)
+                raise AttributeError('%r' % (args,))
 
         else:
-            raise AttributeError, '%r' % (args,)
+            raise AttributeError('%r' % (args,))
         
         if not self.n:
-            raise AttributeError, 'Points on plane are colinear'
+            raise AttributeError('Points on plane are colinear')
 
     def __copy__(self):
         return self.__class__(self.n, self.k)
@@ -2325,3 +3204,104 @@ class Plane:
     def _connect_plane(self, other):
         return _connect_plane_plane(other, self)
 
+# Batch intersection
+# ---------------------------------------------------------------------------
+#
+# These answer many intersection queries at once with numpy, for things
+# like line of sight or "will this car hit that pedestrian" over a whole
+# scene.  The query may be one Line2/Ray2/LineSegment2 (or 3D equivalent)
+# or a sequence of them; results then have shape (n,) or (m, n) for m
+# lines against n targets.  Each line keeps its own extent, so rays and
+# segments only report hits within their range of u.
+#
+# Rather than building Point2/LineSegment2 results, these return a hit mask
+# and the line parameters u of the hits (NaN where there is no hit); the
+# points themselves are p + u * v.
+
+def _batch_lines(lines, line_class):
+    if isinstance(lines, line_class):
+        lines = [lines]
+        single = True
+    else:
+        single = False
+    P = numpy.array([tuple(L.p) for L in lines], dtype=float)
+    V = numpy.array([tuple(L.v) for L in lines], dtype=float)
+    lo = numpy.array([L._u_range[0] for L in lines], dtype=float)
+    hi = numpy.array([L._u_range[1] for L in lines], dtype=float)
+    return P, V, lo, hi, single
+
+def _batch_round(shapes, shape_class):
+    # A sequence of Circles/Spheres, or a (centers, radii) pair of arrays
+    if isinstance(shapes, tuple) and len(shapes) == 2 and \
+       not isinstance(shapes[0], shape_class):
+        centers, radii = shapes
+        if isinstance(centers, Vector2Array):
+            centers = centers.data
+        return (numpy.asarray(centers, dtype=float),
+                numpy.asarray(radii, dtype=float))
+    return (numpy.array([tuple(S.c) for S in shapes], dtype=float),
+            numpy.array([S.r for S in shapes], dtype=float))
+
+def _batch_line_round(lines, line_class, centers, radii):
+    P, V, lo, hi, single = _batch_lines(lines, line_class)
+    # Lines down the first axis, shapes along the second
+    f = P[:, numpy.newaxis, :] - centers[numpy.newaxis, :, :]
+    a = numpy.einsum('ij,ij->i', V, V)[:, numpy.newaxis]
+    b = 2 * numpy.einsum('ij,ikj->ik', V, f)
+    c = numpy.einsum('ikj,ikj->ik', f, f) - radii ** 2
+    det = b ** 2 - 4 * a * c
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        sq = numpy.sqrt(det)
+        u1 = (-b - sq) / (2 * a)
+        u2 = (-b + sq) / (2 * a)
+        lo = lo[:, numpy.newaxis]
+        hi = hi[:, numpy.newaxis]
+        # The chord from u1 to u2 must overlap the line's own extent
+        hit = (det >= 0) & (a != 0) & (u1 <= hi) & (u2 >= lo)
+    u1 = numpy.where(hit, numpy.maximum(u1, lo), numpy.nan)
+    u2 = numpy.where(hit, numpy.minimum(u2, hi), numpy.nan)
+    if single:
+        return hit[0], u1[0], u2[0]
+    return hit, u1, u2
+
+def batch_intersect_line2_circle(lines, circles):
+    '''Intersect lines with circles.
+
+    circles is a sequence of Circle or a (centers, radii) pair of arrays.
+    Returns (hit, u1, u2): where the line enters and leaves each circle,
+    clipped to the line's extent.  Unlike Line2.intersect, a segment that
+    stops short of a circle is a miss rather than a clamped endpoint.
+    '''
+    _require_numpy('batch_intersect_line2_circle')
+    centers, radii = _batch_round(circles, Circle)
+    return _batch_line_round(lines, Line2, centers, radii)
+
+def batch_intersect_line3_sphere(lines, spheres):
+    '''Intersect lines with spheres; see batch_intersect_line2_circle.'''
+    _require_numpy('batch_intersect_line3_sphere')
+    centers, radii = _batch_round(spheres, Sphere)
+    return _batch_line_round(lines, Line3, centers, radii)
+
+def batch_intersect_line2_line2(lines, others):
+    '''Intersect lines with other lines, rays or segments.
+
+    Returns (hit, ua, ub), the parameters of the crossing along each
+    query line and along each of others, as _intersect_line2_line2.
+    '''
+    _require_numpy('batch_intersect_line2_line2')
+    AP, AV, Alo, Ahi, single = _batch_lines(lines, Line2)
+    BP, BV, Blo, Bhi, _ = _batch_lines(others, Line2)
+    AV = AV[:, numpy.newaxis, :]
+    d = BV[:, 1] * AV[..., 0] - BV[:, 0] * AV[..., 1]
+    delta = AP[:, numpy.newaxis, :] - BP[numpy.newaxis, :, :]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        ua = (BV[:, 0] * delta[..., 1] - BV[:, 1] * delta[..., 0]) / d
+        ub = (AV[..., 0] * delta[..., 1] - AV[..., 1] * delta[..., 0]) / d
+        hit = (d != 0) & \
+              (ua >= Alo[:, numpy.newaxis]) & (ua <= Ahi[:, numpy.newaxis]) & \
+              (ub >= Blo) & (ub <= Bhi)
+    ua = numpy.where(hit, ua, numpy.nan)
+    ub = numpy.where(hit, ub, numpy.nan)
+    if single:
+        return hit[0], ua[0], ub[0]
+    return hit, ua, ub
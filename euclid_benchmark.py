@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+#
+# Conformance checks and microbenchmarks for euclid: attribute access,
+# swizzling, and vector, matrix and quaternion arithmetic.
+#
+# Run with "python euclid_benchmark.py [--repeat N]".  Each case reports the
+# best time per operation of several runs, so compare rows within one run
+# rather than across machines.  "--compare python2" also runs every case
+# under another interpreter and prints the two side by side, e.g. to see
+# what moving from Python 2 to Python 3 buys.  "--backends python,numpy"
+# runs the conformance checks and then the cases once per EUCLID_BACKEND.
+# "--json FILE" appends the run to FILE as one JSON object per line, with
+# the interpreter, backend and git revision, for tracking over time ("-"
+# prints it instead of the table).  Every module level _intersect_* and
+# _connect_* function must have a case; a missing one fails the run.
+
+import argparse
+import ast
+import copy
+import json
+import math
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import time
+import timeit
+
+import euclid
+
+# Each case loops NUMBER times, or fewer if that many would take longer
+# than MIN_TIME, so the slow geometry cases don't dominate the run.
+NUMBER = 200000
+MIN_TIME = 0.2
+
+# A bare slotted class with nothing else on it, as the floor for attribute
+# access, plus copies of the old swizzling __getattr__ and __setattr__ so the
+# cost they put on every ordinary access stays visible.
+SETUP = '''
+import euclid
+
+class Plain(object):
+    __slots__ = ['x', 'y']
+
+class LegacySwizzleGet(object):
+    __slots__ = ['x', 'y']
+
+    def __getattr__(self, name):
+        try:
+            return tuple([(self.x, self.y)['xy'.index(c)] for c in name])
+        except ValueError:
+            raise AttributeError(name)
+
+class LegacySwizzleSet(object):
+    __slots__ = ['x', 'y']
+
+    def __setattr__(self, name, value):
+        if len(name) == 1:
+            object.__setattr__(self, name, value)
+        else:
+            l = [self.x, self.y]
+            for c, v in zip(name, value):
+                l['xy'.index(c)] = v
+            object.__setattr__(self, 'x', l[0])
+            object.__setattr__(self, 'y', l[1])
+
+plain = Plain()
+plain.x = 1.0
+plain.y = 2.0
+legacyGet = LegacySwizzleGet()
+legacyGet.x = 1.0
+legacyGet.y = 2.0
+legacySet = LegacySwizzleSet()
+legacySet.x = 1.0
+legacySet.y = 2.0
+v = euclid.Vector2(1.0, 2.0)
+u = euclid.Vector2(3.0, 4.0)
+p = euclid.Point2(5.0, 6.0)
+w = euclid.Vector3(1.0, 2.0, 3.0)
+p3 = euclid.Point3(1.0, 2.0, 3.0)
+m3 = euclid.Matrix3.new_rotate(0.5)
+m4 = euclid.Matrix4.new_rotatex(0.5)
+n4 = euclid.Matrix4.new_translate(1.0, 2.0, 3.0)
+q = euclid.Quaternion.new_rotate_axis(0.5, euclid.Vector3(0.0, 0.0, 1.0))
+r = euclid.Quaternion.new_rotate_axis(1.5, euclid.Vector3(0.0, 1.0, 0.0))
+o = euclid.Vector2()
+o3 = euclid.Vector3()
+n3 = euclid.Matrix3.new_translate(1.0, 2.0)
+
+# Geometry, arranged so that every intersection hits and every connection
+# takes its general (not parallel, not overlapping) path.
+point2 = euclid.Point2(1.0, 3.0)
+line2 = euclid.Line2(euclid.Point2(0.0, 0.0), euclid.Vector2(1.0, 1.0))
+segment2 = euclid.LineSegment2(euclid.Point2(0.0, 4.0), euclid.Point2(4.0, 0.0))
+short2 = euclid.LineSegment2(euclid.Point2(0.0, 4.0), euclid.Point2(1.0, 3.0))
+circle = euclid.Circle(euclid.Point2(2.0, 2.0), 1.5)
+circle2 = euclid.Circle(euclid.Point2(8.0, 2.0), 1.0)
+point3 = euclid.Point3(1.0, 3.0, 2.0)
+line3 = euclid.Line3(euclid.Point3(0.0, 0.0, 0.0), euclid.Vector3(1.0, 1.0, 1.0))
+segment3 = euclid.LineSegment3(euclid.Point3(0.0, 4.0, 1.0),
+                               euclid.Point3(4.0, 0.0, 2.0))
+sphere = euclid.Sphere(euclid.Point3(2.0, 2.0, 2.0), 1.5)
+sphere2 = euclid.Sphere(euclid.Point3(8.0, 2.0, 2.0), 1.0)
+plane = euclid.Plane(euclid.Point3(0.0, 0.0, 5.0), euclid.Vector3(0.0, 0.0, 1.0))
+plane2 = euclid.Plane(euclid.Point3(0.0, 0.0, 9.0), euclid.Vector3(0.0, 0.0, 1.0))
+tilted = euclid.Plane(euclid.Point3(1.0, 0.0, 0.0), euclid.Vector3(1.0, 0.0, 1.0))
+'''
+
+CASES = [
+    ('attribute get (plain slots)', 'plain.x'),
+    ('attribute get (Vector2)', 'v.x'),
+    ('attribute get (legacy swizzle get)', 'legacyGet.x'),
+    ('attribute set (plain slots)', 'plain.x = 3.0'),
+    ('attribute set (Vector2)', 'v.x = 3.0'),
+    ('attribute set (legacy swizzle set)', 'legacySet.x = 3.0'),
+    ('swizzle get v.yx (descriptor)', 'v.yx'),
+    ('swizzle get v.yx (legacy __getattr__)', 'legacyGet.yx'),
+    ('swizzle get w.zyx (descriptor)', 'w.zyx'),
+    ('swizzle get v.xxyy (descriptor)', 'v.xxyy'),
+    ('Vector2 + Vector2', 'v + u'),
+    ('Point2 + Vector2', 'p + u'),
+    ('Vector2 - Vector2', 'v - u'),
+    ('Vector2 * scalar', 'v * 2.5'),
+    ('Vector2 / scalar', 'v / 2.5'),
+    ('Vector2 += Vector2', 'v += u'),
+    ('Vector2.add_scaled', 'v.add_scaled(u, 0.5)'),
+    ('Vector2.set', 'o.set(1.0, 2.0)'),
+    ('Vector2.add_into', 'v.add_into(u, o)'),
+    ('Vector2.sub_into', 'v.sub_into(u, o)'),
+    ('Vector2.scale_into', 'v.scale_into(2.5, o)'),
+    ('Vector2.normalize_into', 'u.normalize_into(o)'),
+    ('Vector2.normalized', 'u.normalized()'),
+    ('Vector2.dot', 'v.dot(u)'),
+    ('abs(Vector2)', 'abs(u)'),
+    ('Vector3 + Vector3', 'w + p3'),
+    ('Vector3 - Vector3', 'w - p3'),
+    ('Vector3 * scalar', 'w * 2.5'),
+    ('Vector3 += Vector3', 'o3 += w'),
+    ('Vector3.normalized', 'w.normalized()'),
+    ('Vector3.dot', 'w.dot(p3)'),
+    ('Vector3.cross', 'w.cross(p3)'),
+    ('Matrix3 * Point2', 'm3 * p'),
+    ('Matrix3 * Matrix3', 'm3 * n3'),
+    ('Matrix3.inverse', 'm3.inverse()'),
+    ('Matrix4 * Matrix4', 'm4 * n4'),
+    ('Matrix4 * Point3', 'm4 * p3'),
+    ('Matrix4.inverse', 'm4.inverse()'),
+    ('Quaternion * Quaternion', 'q * r'),
+    ('Quaternion * Vector3', 'q * w'),
+    ('Quaternion.get_matrix', 'q.get_matrix()'),
+    ('Quaternion.new_interpolate', 'euclid.Quaternion.new_interpolate(q, r, 0.3)'),
+    ('Quaternion.normalized', 'q.normalized()'),
+    ('Quaternion.get_angle_axis', 'q.get_angle_axis()'),
+    ('Quaternion.new_rotate_matrix', 'euclid.Quaternion.new_rotate_matrix(m4)'),
+    ('_intersect_point2_circle', 'euclid._intersect_point2_circle(point2, circle)'),
+    ('_intersect_line2_line2', 'euclid._intersect_line2_line2(line2, segment2)'),
+    ('_intersect_line2_circle', 'euclid._intersect_line2_circle(line2, circle)'),
+    ('_connect_point2_line2', 'euclid._connect_point2_line2(point2, line2)'),
+    ('_connect_point2_circle', 'euclid._connect_point2_circle(point2, circle)'),
+    ('_connect_line2_line2', 'euclid._connect_line2_line2(line2, short2)'),
+    ('_connect_circle_line2', 'euclid._connect_circle_line2(circle2, line2)'),
+    ('_connect_circle_circle', 'euclid._connect_circle_circle(circle, circle2)'),
+    ('_intersect_point3_sphere', 'euclid._intersect_point3_sphere(point3, sphere)'),
+    ('_intersect_line3_sphere', 'euclid._intersect_line3_sphere(line3, sphere)'),
+    ('_intersect_line3_plane', 'euclid._intersect_line3_plane(line3, plane)'),
+    ('_intersect_plane_plane', 'euclid._intersect_plane_plane(plane, tilted)'),
+    ('_connect_point3_line3', 'euclid._connect_point3_line3(point3, line3)'),
+    ('_connect_point3_sphere', 'euclid._connect_point3_sphere(point3, sphere)'),
+    ('_connect_point3_plane', 'euclid._connect_point3_plane(point3, plane)'),
+    ('_connect_line3_line3', 'euclid._connect_line3_line3(line3, segment3)'),
+    ('_connect_line3_plane', 'euclid._connect_line3_plane(segment3, plane)'),
+    ('_connect_sphere_line3', 'euclid._connect_sphere_line3(sphere2, line3)'),
+    ('_connect_sphere_sphere', 'euclid._connect_sphere_sphere(sphere, sphere2)'),
+    ('_connect_sphere_plane', 'euclid._connect_sphere_plane(sphere, plane)'),
+    ('_connect_plane_plane', 'euclid._connect_plane_plane(plane, plane2)'),
+]
+
+def _close(got, expected):
+    if isinstance(expected, (int, float)):
+        return abs(got - expected) < 1e-9
+    got = list(got)
+    return len(got) == len(expected) and \
+           all([_close(g, e) for g, e in zip(got, expected)])
+
+def conformance():
+    '''Check the active backend against known answers.
+
+    Returns a list of failure descriptions, empty when everything passes.
+    '''
+    E = euclid
+    failures = []
+    def check(name, got, expected):
+        try:
+            ok = _close(got, expected)
+        except Exception as e:
+            ok = False
+            got = e
+        if not ok:
+            failures.append('%s: got %r, expected %r' % (name, got, expected))
+
+    v = E.Vector2(3, 4)
+    u = E.Vector2(1, 2)
+    check('Vector2 +', v + u, (4, 6))
+    check('Vector2 -', v - u, (2, 2))
+    check('tuple - Vector2', (10, 10) - v, (7, 6))
+    check('Vector2 * scalar', v * 2, (6, 8))
+    check('scalar * Vector2', 2 * v, (6, 8))
+    check('Vector2 / scalar', v / 2, (1.5, 2))
+    check('-Vector2', -v, (-3, -4))
+    check('abs(Vector2)', abs(v), 5)
+    check('Vector2.magnitude_squared', v.magnitude_squared(), 25)
+    check('Vector2.normalized', v.normalized(), (0.6, 0.8))
+    check('Vector2.normalize zero', E.Vector2().normalize(), (0, 0))
+    check('Vector2.dot', v.dot(u), 11)
+    check('Vector2.angle', v.angle(u), math.acos(11 / (5 * math.sqrt(5))))
+    check('Vector2 swizzle', v.yx + v.xxyy, (4, 3, 3, 3, 4, 4))
+    check('Vector2 indexing', (v[0], v[-1]), (3, 4))
+    check('bool(Vector2)', (bool(v), bool(E.Vector2())), (1, 0))
+    c = v.copy()
+    c.x = 9
+    check('Vector2.copy is independent', v, (3, 4))
+    c += u
+    check('Vector2 +=', c, (10, 6))
+    check('Vector2.add_scaled', c.add_scaled(u, 2), (12, 10))
+    check('Vector2.set', c.set(1, 1), (1, 1))
+    check('Vector2.sub_into', v.sub_into(u, c), (2, 2))
+    check('Point2 + Vector2 type',
+          [type(E.Point2(1, 1) + u) is E.Point2,
+           type(E.Point2(1, 1) - E.Point2(0, 0)) is E.Vector2,
+           isinstance(E.Point2(), E.Vector2)], (1, 1, 1))
+
+    x = E.Vector3(1, 0, 0)
+    y = E.Vector3(0, 1, 0)
+    check('Vector3.cross', x.cross(y), (0, 0, 1))
+    check('Vector3 * Vector3', E.Vector3(1, 2, 3) * E.Vector3(2, 2, 2),
+          (2, 4, 6))
+    check('Vector3.normalized', E.Vector3(0, 3, 4).normalized(), (0, 0.6, 0.8))
+    check('Vector3 swizzle', E.Vector3(1, 2, 3).zyx, (3, 2, 1))
+    w = E.Vector3(1, 1, 1)
+    p = E.Point3(1, 1, 1)
+    check('Point3 + Vector3 type',
+          [type(p + w) is E.Point3,
+           type(w + p) is E.Point3,
+           type(p + p) is E.Vector3,
+           type(w + w) is E.Vector3,
+           isinstance(E.Point3(), E.Vector3)], (1, 1, 1, 1, 1))
+    check('Point3 - Vector3 type',
+          [type(p - w) is E.Point3,
+           type(w - p) is E.Point3,
+           type(p - p) is E.Vector3,
+           type(w - w) is E.Vector3], (1, 1, 1, 1))
+
+    M = E.Matrix3.new_translate(2, 3).rotate(math.pi / 2)
+    check('Matrix3 * Point2', M * E.Point2(1, 0), (2, 4))
+    check('Matrix3 * Vector2', M * E.Vector2(1, 0), (0, 1))
+    check('Matrix3 layout', E.Matrix3.new_translate(2, 3)[:],
+          (1, 0, 0, 0, 1, 0, 2, 3, 1))
+    check('Matrix3.determinant', M.determinant(), 1)
+    check('Matrix3.inverse', (M * M.inverse())[:],
+          (1, 0, 0, 0, 1, 0, 0, 0, 1))
+
+    N = E.Matrix4.new_translate(1, 2, 3)
+    R = E.Matrix4.new_rotatez(math.pi / 2)
+    identity = (1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1)
+    check('Matrix4 * Point3', N * E.Point3(1, 1, 1), (2, 3, 4))
+    check('Matrix4 * Vector3', R * E.Vector3(1, 0, 0), (0, 1, 0))
+    check('Matrix4 * Matrix4', (N * R) * E.Point3(1, 0, 0), (1, 3, 3))
+    check('Matrix4 *=', (R.copy().__imul__(N))[:], (R * N)[:])
+    check('Matrix4.inverse', ((N * R) * (N * R).inverse())[:], identity)
+    check('Matrix4.transposed', N.transposed()[:],
+          (1, 0, 0, 1, 0, 1, 0, 2, 0, 0, 1, 3, 0, 0, 0, 1))
+    P = E.Matrix4.new_perspective(math.pi / 2, 1.0, 1.0, 10.0)
+    # w = 2, z = (-11/9 * -2 - 20/9) = 2/9 before the divide
+    check('Matrix4.transform', P.transform(E.Point3(1, 1, -2)),
+          (0.5, 0.5, 1.0 / 9))
+
+    q = E.Quaternion.new_rotate_axis(math.pi / 2, E.Vector3(0, 0, 1))
+    half = math.sqrt(0.5)
+    check('Quaternion * Vector3', q * E.Vector3(1, 0, 0), (0, 1, 0))
+    check('Quaternion * Quaternion', (q * q) * E.Vector3(1, 0, 0), (-1, 0, 0))
+    check('Quaternion.get_matrix', q.get_matrix() * E.Vector3(1, 0, 0),
+          (0, 1, 0))
+    check('abs(Quaternion)', abs(q), 1)
+    check('Quaternion.normalized', abs(E.Quaternion(2, 0, 0, 0).normalized()),
+          1)
+    check('Quaternion.conjugated', q.conjugated() * E.Vector3(1, 0, 0),
+          (0, -1, 0))
+    check('Quaternion.new_interpolate',
+          E.Quaternion.new_interpolate(E.Quaternion(), q, 0.5) * x,
+          (half, half, 0))
+
+    check('pickle', [pickle.loads(pickle.dumps(o)) == o
+                     for o in (v, E.Vector3(1, 2, 3), E.Point2(1, 2))],
+          (1, 1, 1))
+    check('pickle Matrix4', pickle.loads(pickle.dumps(N))[:], N[:])
+    check('copy.copy Quaternion', abs(copy.copy(q)), 1)
+    s = E.Line2(E.Point2(0, 0), E.Vector2(1, 0)).intersect(
+        E.Circle(E.Point2(5, 0), 1.0))
+    check('Line2.intersect(Circle)', tuple(s.p1) + tuple(s.p2), (6, 0, 4, 0))
+    check('batch_transform_points', E.batch_transform_points(N, [(1, 1, 1)])[0],
+          (2, 3, 4))
+
+    # The batch quaternion functions, row by row against the scalar methods
+    # they stand in for, which are called explicitly so the numpy backend
+    # isn't checked against itself.
+    S = E.ScalarQuaternion
+    rng = random.Random(1)
+    def rows(quaternions):
+        return [(q.w, q.x, q.y, q.z) for q in quaternions]
+    def randoms(n, size=1):
+        return [S(*[rng.uniform(-size, size) for i in range(4)])
+                for i in range(n)]
+    def nudged(q, sign):
+        return S.normalized(S(*[sign * c + rng.uniform(-1e-4, 1e-4)
+                                for c in (q.w, q.x, q.y, q.z)]))
+    starts = [S.normalized(q) for q in randoms(20)]
+    ends = {
+        'random': [S.normalized(q) for q in randoms(20)],
+        'equal': [S(q.w, q.x, q.y, q.z) for q in starts],
+        'near-equal': [nudged(q, 1) for q in starts],
+        'near-opposite': [nudged(q, -1) for q in starts],
+    }
+    ts = [rng.random() for q in starts]
+    for case in sorted(ends):
+        check('batch_quaternion_interpolate %s' % case,
+              E.batch_quaternion_interpolate(rows(starts), rows(ends[case]),
+                                             ts),
+              rows([S.new_interpolate(q1, q2, t)
+                    for q1, q2, t in zip(starts, ends[case], ts)]))
+    check('batch_quaternion_interpolate single t',
+          E.batch_quaternion_interpolate(rows(starts), rows(ends['random']),
+                                         0.25),
+          rows([S.new_interpolate(q1, q2, 0.25)
+                for q1, q2 in zip(starts, ends['random'])]))
+    unnormalized = randoms(20, 5) + [S(0, 0, 0, 0)]
+    check('batch_quaternion_normalize',
+          E.batch_quaternion_normalize(rows(unnormalized)),
+          rows([S.normalized(q) for q in unnormalized]))
+    # get_matrix flattens column by column, the batch matrices are row major
+    check('batch_quaternion_matrix',
+          [M.T.ravel() for M in E.batch_quaternion_matrix(rows(starts))],
+          [S.get_matrix(q)[:] for q in starts])
+
+    # The batch intersections, row by row against Line2.intersect and
+    # Line3.intersect, as (0,) for a miss or (1, entry, exit) for a hit.
+    def batched(lines, hit, u1, u2):
+        return [[(1,) + tuple(L.p + L.v * a) + tuple(L.p + L.v * b)
+                 if h else (0,) for h, a, b in zip(*row)]
+                for L, row in zip(lines, zip(hit.tolist(), u1.tolist(),
+                                             u2.tolist()))]
+    def scalar(lines, shapes):
+        # Line3.intersect always gives a segment, Line2.intersect a point
+        # where the line only touches
+        expected = []
+        for L in lines:
+            row = []
+            for shape in shapes:
+                s = L.intersect(shape)
+                if s is None:
+                    row.append((0,))
+                elif isinstance(s, (E.Point2, E.Point3)):
+                    row.append((1,) + tuple(s) + tuple(s))
+                else:
+                    row.append((1,) + tuple(s.p2) + tuple(s.p1))
+            expected.append(row)
+        return expected
+
+    P2 = E.Point2
+    V2 = E.Vector2
+    circles = [E.Circle(P2(5, 0), 1.0), E.Circle(P2(3, 2), 2.5)]
+    lines = [E.Line2(P2(0, 0), V2(1, 0)), E.Line2(P2(5, 0), V2(1, 0.5)),
+             E.Line2(P2(0, 3.5), V2(1, 0)),
+             E.Ray2(P2(0, 0), V2(1, 0)), E.Ray2(P2(5, 0), V2(1, 0.5)),
+             E.Ray2(P2(0, 3.5), V2(1, 0)),
+             E.LineSegment2(P2(0, 0), P2(10, 0)),
+             E.LineSegment2(P2(5, 0), P2(8, 1)),
+             E.LineSegment2(P2(0, 0), P2(5, 0.5)),
+             E.LineSegment2(P2(0, 3.5), P2(8, 3.5))]
+    check('batch_intersect_line2_circle',
+          batched(lines, *E.batch_intersect_line2_circle(lines, circles)),
+          scalar(lines, circles))
+    others = [E.Line2(P2(2, -5), V2(0, 1)), E.Ray2(P2(2, 1), V2(0, 1)),
+              E.LineSegment2(P2(-1, -1), P2(1, 1)),
+              E.LineSegment2(P2(0, 1), P2(9, 1)),
+              E.Line2(P2(0, 4), V2(1, 0))]
+    hit, ua, ub = E.batch_intersect_line2_line2(lines, others)
+    check('batch_intersect_line2_line2',
+          [[(1,) + tuple(L.p + L.v * u) if h else (0,)
+            for h, u in zip(*row)]
+           for L, row in zip(lines, zip(hit.tolist(), ua.tolist()))],
+          [[(0,) if L.intersect(M) is None else (1,) + tuple(L.intersect(M))
+            for M in others] for L in lines])
+    check('batch_intersect_line2_line2 ub',
+          [[tuple(M.p + M.v * u) for M, u in zip(others, row) if u == u]
+           for row in ub.tolist()],
+          [[tuple(L.intersect(M)) for M in others
+            if L.intersect(M) is not None] for L in lines])
+
+    P3 = E.Point3
+    V3 = E.Vector3
+    spheres = [E.Sphere(P3(5, 0, 0), 1.0), E.Sphere(P3(3, 2, 1), 2.5)]
+    lines3 = [E.Line3(P3(0, 0, 0), V3(1, 0, 0)),
+              E.Line3(P3(5, 0, 0), V3(1, 0.5, 0.25)),
+              E.Line3(P3(0, 4, 4), V3(1, 0, 0)),
+              E.Ray3(P3(0, 0, 0), V3(1, 0, 0)),
+              E.Ray3(P3(5, 0, 0), V3(1, 0.5, 0.25)),
+              E.Ray3(P3(0, 4, 4), V3(1, 0, 0)),
+              E.LineSegment3(P3(0, 0, 0), P3(10, 0, 0)),
+              E.LineSegment3(P3(5, 0, 0), P3(8, 1, 0.5)),
+              E.LineSegment3(P3(0, 0, 0), P3(5, 0.5, 0)),
+              E.LineSegment3(P3(0, 4, 4), P3(8, 4, 4))]
+    check('batch_intersect_line3_sphere',
+          batched(lines3, *E.batch_intersect_line3_sphere(lines3, spheres)),
+          scalar(lines3, spheres))
+
+    # Where a segment stops short of the circle, or a ray points away from
+    # it, intersect clamps to the nearest end and the batch functions miss
+    short = [E.LineSegment2(P2(0, 0), P2(2, 0)), E.Ray2(P2(8, 0), V2(1, 0))]
+    check('Line2.intersect stops short',
+          [tuple(L.intersect(circles[0])) for L in short], ((2, 0), (8, 0)))
+    check('batch_intersect_line2_circle stops short',
+          E.batch_intersect_line2_circle(short, circles[:1])[0][:, 0],
+          (0, 0))
+    short3 = [E.LineSegment3(P3(0, 0, 0), P3(2, 0, 0)),
+              E.Ray3(P3(8, 0, 0), V3(1, 0, 0))]
+    check('Line3.intersect stops short',
+          [tuple(L.intersect(spheres[0]).p1) +
+           tuple(L.intersect(spheres[0]).p2) for L in short3],
+          ((2, 0, 0, 2, 0, 0), (8, 0, 0, 8, 0, 0)))
+    check('batch_intersect_line3_sphere stops short',
+          E.batch_intersect_line3_sphere(short3, spheres[:1])[0][:, 0],
+          (0, 0))
+    return failures
+
+def uncovered():
+    '''Return the module level _intersect_* and _connect_* functions that
+    no case calls.'''
+    names = [name for name in dir(euclid)
+             if name.startswith(('_intersect_', '_connect_')) and
+             callable(getattr(euclid, name))]
+    stmts = ' '.join([stmt for name, stmt in CASES])
+    return [name for name in names if 'euclid.%s(' % name not in stmts]
+
+def _number(timer):
+    # Like Timer.autorange, which Python 2 lacks, but capped at NUMBER.
+    number = 10
+    while number < NUMBER:
+        if timer.timeit(number) * 10 >= MIN_TIME:
+            break
+        number *= 10
+    return min(number, NUMBER)
+
+def run(repeat=3):
+    results = []
+    for name, stmt in CASES:
+        timer = timeit.Timer(stmt, SETUP)
+        number = _number(timer)
+        best = min(timer.repeat(repeat, number)) / number
+        results.append((name, best))
+    return results
+
+def revision():
+    '''The git revision of the working tree, or None outside a checkout.'''
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                             cwd=here, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+def record(results, repeat):
+    '''The run as a JSON-serialisable dict, with times in nanoseconds.'''
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': revision(),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'backend': euclid.backend,
+        'repeat': repeat,
+        'results': dict([(name, best * 1e9) for name, best in results]),
+    }
+
+def writeRecord(record, path):
+    line = json.dumps(record, sort_keys=True)
+    if path == '-':
+        print(line)
+        return
+    with open(path, 'a') as output:
+        output.write(line + '\n')
+
+def runUnder(python, repeat, backend=None):
+    '''Run the cases in a child interpreter, returning (failures, results)
+    where results is {name: seconds}.'''
+    env = dict(os.environ)
+    if backend is not None:
+        env['EUCLID_BACKEND'] = backend
+    output = subprocess.check_output([python, __file__, '--raw',
+                                      '--repeat', str(repeat)], env=env)
+    failures, results = ast.literal_eval(output.decode('ascii'))
+    return failures, dict(results)
+
+def main(args):
+    parser = argparse.ArgumentParser(description='euclid microbenchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compare', metavar='PYTHON',
+                        help='also run under this interpreter')
+    parser.add_argument('--backends', metavar='NAMES',
+                        help='comma separated EUCLID_BACKENDs to compare')
+    parser.add_argument('--json', metavar='FILE',
+                        help='append the results to FILE, - for stdout')
+    parser.add_argument('--raw', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+
+    if options.backends:
+        compareBackends(options.backends.split(','), options.repeat)
+        return
+
+    failures = conformance()
+    if options.raw:
+        print(repr((failures, run(options.repeat))))
+        return
+
+    failures.extend(['no case for %s' % name for name in uncovered()])
+    if options.json != '-':
+        print('euclid backend: %s' % euclid.backend)
+    for failure in failures:
+        print('FAIL %s' % failure)
+    if failures:
+        sys.exit(1)
+
+    results = run(options.repeat)
+    if options.json:
+        writeRecord(record(results, options.repeat), options.json)
+        if options.json == '-':
+            return
+    if not options.compare:
+        for name, best in results:
+            print('%-40s %8.1f ns' % (name, best * 1e9))
+        return
+
+    otherFailures, other = runUnder(options.compare, options.repeat)
+    for failure in otherFailures:
+        print('FAIL (%s) %s' % (options.compare, failure))
+    print('%-40s %11s %11s %8s' % ('', options.compare[-11:],
+                                  'this', 'speedup'))
+    for name, best in results:
+        print('%-40s %8.1f ns %8.1f ns %7.2fx' % \
+              (name, other[name] * 1e9, best * 1e9, other[name] / best))
+
+def compareBackends(backends, repeat):
+    columns = []
+    failed = False
+    for backend in backends:
+        failures, results = runUnder(sys.executable, repeat, backend)
+        for failure in failures:
+            print('FAIL (%s) %s' % (backend, failure))
+        failed = failed or failures
+        columns.append(results)
+
+    print(('%-40s' % '') + ''.join(['%12s' % b for b in backends]))
+    for name, stmt in CASES:
+        print(('%-40s' % name) +
+              ''.join(['%9.1f ns' % (c[name] * 1e9) for c in columns]))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
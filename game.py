@@ -16,48 +16,202 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import pygame
 import random
 import euclid
 import math
+import argparse
+import collections
+import copy
+import json
+import time
 
-class CrashPredictor(pygame.sprite.Sprite):
-    def __init__(self, vehicle):
-        super(CrashPredictor, self).__init__()
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#images are loaded once and shared by every sprite that uses them, so never
+#draw onto a surface returned from here
+imageCache = {}
+
+def loadImage(filename, opaque=False):
+    image = imageCache.get(filename)
+    if image is None:
+        image = pygame.image.load(filename)
+        
+        #match the display format so blits don't convert every frame
+        if pygame.display.get_surface() is not None:
+            if opaque or not (image.get_flags() & pygame.SRCALPHA):
+                image = image.convert()
+            else:
+                image = image.convert_alpha()
+                
+        imageCache[filename] = image
+        
+    return image
+    
+#rotations are snapped to this many angles and kept, so turning a sprite is a
+#lookup rather than a transform. The cache only ever holds ROTATION_STEPS
+#images per source image, so it doesn't need evicting.
+ROTATION_STEPS = 72
+rotationCache = {}
+
+def rotateImage(image, angle):
+    rotations = rotationCache.get(image)
+    if rotations is None:
+        rotations = [None] * ROTATION_STEPS
+        rotationCache[image] = rotations
+        
+    step = int(round(angle * ROTATION_STEPS / 360.0)) % ROTATION_STEPS
+    rotated = rotations[step]
+    if rotated is None:
+        rotated = pygame.transform.rotate(image, step * 360.0 / ROTATION_STEPS)
+        rotations[step] = rotated
+        
+    return rotated
+    
+def personImages(character):
+    #stand, step left, step right and dead images for a character
+    return ('images/person' + character + '.png',
+            'images/personstepleft' + character + '.png',
+            'images/personstepright' + character + '.png',
+            'images/deadperson' + character + '.png')
+
+class CrashPredictor(object):
+    #the stretch of road a vehicle keeps clear in front of it. Vehicles ahead
+    #are found through the lane, the rect is only checked against people.
+    def __init__(self, vehicle, image):
         self.vehicle = vehicle
-        self.image = pygame.image.load('images/collider.png')
+        self.image = image
+        self.reach = self.image.get_width()
         self.rect = pygame.Rect(0, 0, self.image.get_width(), self.image.get_height())
         
     def update(self):
         xOff = (self.vehicle.image.get_width() / 2) + (self.image.get_width() / 2)
-        if self.vehicle.velocity.x > 0:
-            offset = euclid.Vector2(xOff, 0)
-        else:
-            offset = euclid.Vector2(-xOff, 0)
+        if self.vehicle.velocity.x <= 0:
+            xOff = -xOff
+            
+        self.rect.center = (self.vehicle.position.x + xOff, self.vehicle.position.y)
+        
+    def obstruction(self):
+        #the vehicle ahead, if it is within reach
+        lane = self.vehicle.lane
+        gap = lane.gap(self.vehicle)
+        if gap is not None and gap < self.reach:
+            return lane.leader(self.vehicle)
             
-        self.rect.center = self.vehicle.position + offset
+        return None
+        
+class Lane(object):
+    #the vehicles travelling one way along a lane, kept front to back so the
+    #vehicle ahead of any other is its neighbour in the list
+    def __init__(self, direction):
+        self.direction = direction
+        self.vehicles = list()
+        
+    def __len__(self):
+        return len(self.vehicles)
+        
+    def add(self, vehicle):
+        #vehicles enter at the back of the lane
+        vehicle.lane = self
+        vehicle.laneIndex = len(self.vehicles)
+        self.vehicles.append(vehicle)
+        
+    def remove(self, vehicle):
+        del self.vehicles[vehicle.laneIndex]
+        for index in range(vehicle.laneIndex, len(self.vehicles)):
+            self.vehicles[index].laneIndex = index
+            
+        vehicle.lane = None
+        
+    def reorder(self):
+        #insertion sort after vehicles move. They hardly ever pass each other
+        #so this is linear in practice.
+        vehicles = self.vehicles
+        for index in range(1, len(vehicles)):
+            vehicle = vehicles[index]
+            progress = vehicle.position.x * self.direction
+            other = index
+            while other > 0 and vehicles[other - 1].position.x * self.direction < progress:
+                vehicles[other] = vehicles[other - 1]
+                vehicles[other].laneIndex = other
+                other -= 1
+                
+            vehicles[other] = vehicle
+            vehicle.laneIndex = other
+            
+    def leader(self, vehicle):
+        if vehicle.laneIndex == 0:
+            return None
+            
+        return self.vehicles[vehicle.laneIndex - 1]
+        
+    def last(self):
+        if len(self.vehicles) == 0:
+            return None
+            
+        return self.vehicles[-1]
+        
+    def gap(self, vehicle):
+        #distance from the front of the vehicle to the back of the one ahead
+        leader = self.leader(vehicle)
+        if leader is None:
+            return None
+            
+        if self.direction > 0:
+            return leader.rect.left - vehicle.rect.right
+        else:
+            return vehicle.rect.left - leader.rect.right
 
+class VehicleTemplate(object):
+    #everything about a type of vehicle that is the same for every spawn,
+    #including its image facing either way
+    def __init__(self, name, image, maxVelocity, acceleration, brakesound, track):
+        self.name = name
+        self.images = {1: image, -1: pygame.transform.flip(image, True, False)}
+        self.maxVelocity = maxVelocity
+        self.acceleration = acceleration
+        self.brakesound = brakesound
+        self.track = track
+        self.collider = loadImage('images/collider.png')
+        
 class Vehicle(pygame.sprite.DirtySprite):
-    def __init__(self, image, maxVelocity, brakesound, acceleration):
+    def __init__(self, template, direction):
+        #direction is 1 for left to right, -1 for right to left
         super(Vehicle, self).__init__()
-        self.image = image
+        self.template = template
+        self.image = template.images[direction]
         self.position = euclid.Vector2(0, 0)
-        self.velocity = euclid.Vector2(0, 0)
+        self.previousPosition = None
+        self.velocity = euclid.Vector2(template.maxVelocity * direction, 0)
         self.rect = pygame.Rect(0, 0, self.image.get_width(), self.image.get_height())
-        self.crashPredictor = CrashPredictor(self)
-        self.maxVelocity = maxVelocity
+        self.crashPredictor = CrashPredictor(self, template.collider)
+        self.lane = None
+        self.laneIndex = 0
+        self.maxVelocity = template.maxVelocity
         self.braking = False
-        self.brakesound = brakesound
-        self.acceleration = acceleration
+        self.brakesound = template.brakesound
+        self.acceleration = template.acceleration
         
-    def update(self):
-        self.position += self.velocity #need to include time elapsed here or the speed will depend on frame rate
-        self.rect = pygame.Rect(0, 0, self.image.get_width(), self.image.get_height())
+    def update(self, scale=1.0):
+        #scale is the length of the simulation step in frames at Game.TICKS_PER_SECOND
+        self.move(scale)
+        self.refresh()
+        
+    def move(self, scale):
+        self.position.add_scaled(self.velocity, scale)
+        
+    def refresh(self):
+        #vehicles never change image, so the rect only needs moving
         self.rect.center = self.position
+        self.crashPredictor.update()
         
-    def brake(self, collisions):
+    def brake(self, collisions, scale=1.0):
         #todo set deceleration based on vehicle type
-        self.velocity.x *= 1.0 - self.acceleration
+        self.velocity.x *= (1.0 - self.acceleration) ** scale
         
         #only play sounds when we first start braking
         if self.braking:
@@ -70,12 +224,12 @@ class Vehicle(pygame.sprite.DirtySprite):
             if type(sprite) is Person:
                 self.brakesound.play()
                 
-    def accelerate(self):
+    def accelerate(self, scale=1.0):
         self.braking = False
         self.brakesound.stop()
         
         #todo set acceleration based on vehicle type
-        self.velocity.x *= 1.0 + self.acceleration
+        self.velocity.x *= (1.0 + self.acceleration) ** scale
                 
         #if the car stops, give it a little push. This is a bit hackish, eh?
         #especially the use of Game.HEIGHT rather than screen.get_height()
@@ -88,10 +242,18 @@ class Vehicle(pygame.sprite.DirtySprite):
 class Player(pygame.sprite.DirtySprite):
     GHOST_SPEED = 10
     POSSESS_SPEED_MULTIPLIER = 4
+    ANIMATION_FRAMES = 60
+    
+    #spin in and spin out frames for each base image, see bakeAnimations
+    animations = {}
+    
     def __init__(self, image):
         super(Player, self).__init__()
-        self.baseimage = pygame.image.load(image)
+        self.baseimage = loadImage(image)
+        self.spinIn, self.spinOut = Player.bakeAnimations(self.baseimage)
+        self.image = self.baseimage
         self.position = euclid.Vector2(0, 0)
+        self.previousPosition = None
         self.rect = pygame.Rect(0, 0, self.baseimage.get_width(), self.baseimage.get_height())
         self.host = None
         self.direction = euclid.Vector2(0, 0)
@@ -99,38 +261,55 @@ class Player(pygame.sprite.DirtySprite):
         self.animationFrameCount = 0
         self.hostGoalY = 0
         
-    def update(self):
-        self.position += self.direction * self.speed
+    def update(self, scale=1.0):
+        self.position.add_scaled(self.direction, self.speed * scale)
         
         if self.host is not None:
             if self.host.dead:
                 self.dispossess()
             else:
-                self.host.position = euclid.Vector2(self.position.x, self.position.y)
-                self.host.goal = self.position + (self.direction * 10)
+                self.host.position.set(self.position.x, self.position.y)
+                self.host.goal.set(self.position.x, self.position.y).add_scaled(self.direction, 10)
                 
-        self.animationFrameCount += 1
-        if self.host is None:
-            if self.animationFrameCount > 60:
-                self.image = self.baseimage
-            else:
-                angle = self.animationFrameCount * 16
-                scale = 0.25 + (0.75 / max(60 - self.animationFrameCount*1, 1))
-                self.image = pygame.transform.rotozoom(self.baseimage, angle, scale)
+        self.animationFrameCount += scale
+        if self.animationFrameCount > Player.ANIMATION_FRAMES:
+            frame = Player.ANIMATION_FRAMES + 1
         else:
-            if self.animationFrameCount > 60:
-                angle = 0
-                scale = 0.25
-            else:
-                angle = self.animationFrameCount * -16
-                scale = 0.25 + (0.75 / (self.animationFrameCount*1))
+            frame = max(int(self.animationFrameCount), 1)
             
-            self.image = pygame.transform.rotozoom(self.baseimage, angle, scale)
+        if self.host is None:
+            self.image = self.spinOut[frame]
+        else:
+            self.image = self.spinIn[frame]
             
-        self.rect = pygame.Rect(0, 0, self.image.get_width(), self.image.get_height())
+        self.rect.size = self.image.get_size()
         self.rect.center = self.position
         
         
+    @staticmethod
+    def bakeAnimations(baseimage):
+        #rotozoom every frame of the possess (spin in) and dispossess (spin out)
+        #animations once. Index 0 is unused, ANIMATION_FRAMES + 1 is the
+        #image to hold once the animation is over.
+        frames = Player.animations.get(baseimage)
+        if frames is None:
+            spinIn = [None]
+            spinOut = [None]
+            for frame in range(1, Player.ANIMATION_FRAMES + 1):
+                scale = 0.25 + (0.75 / frame)
+                spinIn.append(pygame.transform.rotozoom(baseimage, frame * -16, scale))
+                
+                scale = 0.25 + (0.75 / max(Player.ANIMATION_FRAMES - frame, 1))
+                spinOut.append(pygame.transform.rotozoom(baseimage, frame * 16, scale))
+                
+            spinIn.append(pygame.transform.rotozoom(baseimage, 0, 0.25))
+            spinOut.append(baseimage)
+            
+            frames = (spinIn, spinOut)
+            Player.animations[baseimage] = frames
+            
+        return frames
+        
     def possess(self, person):
         self.host = person
         self.animationFrameCount = 0
@@ -138,20 +317,24 @@ class Player(pygame.sprite.DirtySprite):
         self.speed = person.speed * Player.POSSESS_SPEED_MULTIPLIER
         
     def dispossess(self):
-        self.host.goal = euclid.Vector2(self.host.position.x, self.hostGoalY)
+        self.host.goal.set(self.host.position.x, self.hostGoalY)
         self.host = None
         self.animationFrameCount = 0
         self.speed = Player.GHOST_SPEED
         
+#the way people face when their angle is 0, never modify it
+DOWN = euclid.Vector2(0, 1)
+
 class Person(pygame.sprite.DirtySprite):
     def __init__(self, image, stepLeftImage, stepRightImage, deadimage, deathsound):
         super(Person, self).__init__()
-        self.baseimage = pygame.image.load(image)
-        self.baseImageStepLeft = pygame.image.load(stepLeftImage)
-        self.baseImageStepRight = pygame.image.load(stepRightImage)
+        self.baseimage = loadImage(image)
+        self.baseImageStepLeft = loadImage(stepLeftImage)
+        self.baseImageStepRight = loadImage(stepRightImage)
         self.image = None
-        self.deadimage = pygame.image.load(deadimage)
+        self.deadimage = loadImage(deadimage)
         self.position = euclid.Vector2(0, 0)
+        self.previousPosition = None
         self.rect = pygame.Rect(0, 0, self.baseimage.get_width(), self.baseimage.get_height())
         self.dead = False
         self.deathsound = deathsound
@@ -161,38 +344,450 @@ class Person(pygame.sprite.DirtySprite):
         self.animationFrameCount = 0
         self.currentBaseImage = self.baseimage
         
-    def update(self):
+    def update(self, scale=1.0):
         if (not self.dead) and (self.goal is not None):
-            self.currentDirection = (self.goal - self.position).normalize()
-            velocity = self.currentDirection * self.speed
-            self.position += velocity
-        
-            try:
-                angle = math.degrees(self.currentDirection.angle(euclid.Vector2(0, 1)))
-            except ZeroDivisionError:
-                angle = 0 #no direction, probably possessed and no keys depressed
-            
-            # bit of a hack
-            if self.currentDirection.x < 0:
-                angle = -angle
-            
-            self.animationFrameCount += 1
-            if self.animationFrameCount % 30 == 0:
-                self.animationFrameCount = 0
-                if self.currentBaseImage is self.baseImageStepLeft:
-                    self.currentBaseImage = self.baseImageStepRight
-                else:
-                    self.currentBaseImage = self.baseImageStepLeft
+            self.move(scale)
+            self.animate(scale)
             
-            self.image = pygame.transform.rotate(self.currentBaseImage, angle)
-            self.rect = pygame.Rect(0, 0, self.image.get_width(), self.image.get_height())
-            self.rect.center = self.position
+    def move(self, scale):
+        self.goal.sub_into(self.position, self.currentDirection).normalize()
+        self.position.add_scaled(self.currentDirection, self.speed * scale)
+        
+    def animate(self, scale):
+        try:
+            angle = math.degrees(self.currentDirection.angle(DOWN))
+        except ZeroDivisionError:
+            angle = 0 #no direction, probably possessed and no keys depressed
+        
+        # bit of a hack
+        if self.currentDirection.x < 0:
+            angle = -angle
+            
+        self.face(angle, scale)
+        
+    def face(self, angle, scale):
+        #step the walk animation and turn to angle degrees from DOWN
+        self.animationFrameCount += scale
+        if self.animationFrameCount >= 30:
+            self.animationFrameCount -= 30
+            if self.currentBaseImage is self.baseImageStepLeft:
+                self.currentBaseImage = self.baseImageStepRight
+            else:
+                self.currentBaseImage = self.baseImageStepLeft
+        
+        self.image = rotateImage(self.currentBaseImage, angle)
+        self.rect.size = self.image.get_size()
+        #a tuple, pygame reads a Vector2 through slow python indexing
+        self.rect.center = (self.position.x, self.position.y)
         
     def kill(self):
         self.dead = True
         self.deathsound.play()
         self.image = self.deadimage
         
+class EntityList(object):
+    #the people an EntityStore moves, in no particular order. Removing one
+    #moves the last into its place, so adding and removing are both cheap.
+    def __init__(self):
+        self.entities = list()
+        
+    def __len__(self):
+        return len(self.entities)
+        
+    def add(self, entity):
+        entity.storeIndex = len(self.entities)
+        self.entities.append(entity)
+        
+    def remove(self, entity):
+        index = entity.storeIndex
+        last = self.entities.pop()
+        if last is not entity:
+            self.entities[index] = last
+            last.storeIndex = index
+            
+        entity.storeIndex = None
+        
+class EntityStore(object):
+    #a per tick batch mover for the people still walking, not a structure of
+    #arrays: all it keeps between ticks is the list of those people. Each
+    #tick movePeople() builds one array from their positions, goals and
+    #speeds, moves and turns them all with a handful of array operations
+    #instead of a few python calls each, and writes the results back to the
+    #sprites' own plain vectors, which everything else reads at full speed.
+    #Vehicles only need one multiply add each, which python does faster than
+    #filling an array, so they aren't in here.
+    
+    #below this many people, filling the arrays costs more than it saves
+    BATCH_MIN = 24
+    
+    def __init__(self):
+        self.people = EntityList()
+        
+    def movePeople(self, scale):
+        #same as Person.move then Person.animate for all of them
+        people = self.people.entities
+        if len(people) < EntityStore.BATCH_MIN:
+            for person in people:
+                person.update(scale)
+            return
+            
+        rows = numpy.array([(person.position.x, person.position.y, person.goal.x, person.goal.y, person.speed)
+                            for person in people], dtype=float)
+        position = rows[:, 0:2]
+        direction = rows[:, 2:4] - position
+        length = numpy.sqrt(direction[:, 0] ** 2 + direction[:, 1] ** 2)
+        moving = length != 0
+        direction[moving] /= length[moving, numpy.newaxis]
+        position += direction * (rows[:, 4, numpy.newaxis] * scale)
+        
+        #the angle from DOWN, negative when facing left
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            cosine = direction[:, 1] / numpy.sqrt(direction[:, 0] ** 2 + direction[:, 1] ** 2)
+        angle = numpy.degrees(numpy.arccos(numpy.clip(cosine, -1.0, 1.0)))
+        angle[~moving] = 0
+        angle[direction[:, 0] < 0] *= -1
+        
+        for person, (x, y, dx, dy), facing in zip(people, numpy.hstack((position, direction)).tolist(), angle.tolist()):
+            person.position.x = x
+            person.position.y = y
+            person.currentDirection.x = dx
+            person.currentDirection.y = dy
+            person.face(facing, scale)
+            
+def rectArray(rects):
+    #(n, 4) array of left, top, width, height
+    return numpy.array([tuple(rect) for rect in rects], dtype=float).reshape(-1, 4)
+    
+def collideRects(rectsA, rectsB):
+    #Rect.colliderect between every row of rectsA and every row of rectsB,
+    #as an (a, b) boolean array
+    ax = rectsA[:, 0, numpy.newaxis]
+    ay = rectsA[:, 1, numpy.newaxis]
+    aw = rectsA[:, 2, numpy.newaxis]
+    ah = rectsA[:, 3, numpy.newaxis]
+    bx, by, bw, bh = rectsB[:, 0], rectsB[:, 1], rectsB[:, 2], rectsB[:, 3]
+    return ((ax < bx + bw) & (bx < ax + aw) & (ay < by + bh) & (by < ay + ah) &
+            (aw > 0) & (ah > 0) & (bw > 0) & (bh > 0))
+            
+def collideBatch(cars, people):
+    #every car/person overlap that runCars and runPeople ask about, for the
+    #whole tick in one go. Returns (ahead, under): ahead maps each car to the
+    #people in its crash predictor (brake events), under maps each person to
+    #the cars on top of them (kill events, if the car is moving). Sprites
+    #with nothing touching them are left out.
+    ahead = dict()
+    under = dict()
+    if len(cars) == 0 or len(people) == 0:
+        return ahead, under
+        
+    carRects = rectArray([car.rect for car in cars])
+    predictorRects = rectArray([car.crashPredictor.rect for car in cars])
+    personRects = rectArray([person.rect for person in people])
+    
+    for carIndex, personIndex in zip(*numpy.nonzero(collideRects(predictorRects, personRects))):
+        ahead.setdefault(cars[carIndex], list()).append(people[personIndex])
+        
+    for personIndex, carIndex in zip(*numpy.nonzero(collideRects(personRects, carRects))):
+        under.setdefault(people[personIndex], list()).append(cars[carIndex])
+        
+    return ahead, under
+    
+class SpatialGrid(object):
+    #buckets sprites by the grid cells their rect overlaps so collision
+    #checks only look at nearby sprites rather than the whole group. Call
+    #move() whenever a sprite's rect changes.
+    CELL_SIZE = 128
+    
+    def __init__(self, cellSize=CELL_SIZE):
+        self.cellSize = cellSize
+        self.cells = dict()
+        self.spans = dict()
+        #insertion order, so results come back in the same order every run
+        self.order = dict()
+        self.added = 0
+        
+    def __len__(self):
+        return len(self.spans)
+        
+    def span(self, rect):
+        #range of cells covered by rect, inclusive
+        size = self.cellSize
+        return (rect.left // size, rect.top // size, (rect.right - 1) // size, (rect.bottom - 1) // size)
+        
+    def add(self, sprite):
+        span = self.span(sprite.rect)
+        self.spans[sprite] = span
+        self.order[sprite] = self.added
+        self.added += 1
+        self.insert(sprite, span)
+        
+    def remove(self, sprite):
+        span = self.spans.pop(sprite, None)
+        if span is not None:
+            del self.order[sprite]
+            self.erase(sprite, span)
+            
+    def move(self, sprite):
+        span = self.span(sprite.rect)
+        oldSpan = self.spans[sprite]
+        if span != oldSpan:
+            self.erase(sprite, oldSpan)
+            self.insert(sprite, span)
+            self.spans[sprite] = span
+            
+    def insert(self, sprite, span):
+        left, top, right, bottom = span
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = self.cells.get((x, y))
+                if cell is None:
+                    self.cells[(x, y)] = [sprite]
+                else:
+                    cell.append(sprite)
+                    
+    def erase(self, sprite, span):
+        left, top, right, bottom = span
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = self.cells[(x, y)]
+                cell.remove(sprite)
+                if len(cell) == 0:
+                    del self.cells[(x, y)]
+                    
+    def collide(self, sprite):
+        #same as pygame.sprite.spritecollide(sprite, group, False)
+        rect = sprite.rect
+        left, top, right, bottom = self.span(rect)
+        nearby = set()
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = self.cells.get((x, y))
+                if cell is not None:
+                    nearby.update(cell)
+                    
+        collisions = [other for other in nearby if rect.colliderect(other.rect)]
+        if len(collisions) > 1:
+            collisions.sort(key=self.order.get)
+            
+        return collisions
+        
+class GlyphAtlas(object):
+    #every character of a font rendered once, text is put together by
+    #blitting glyphs instead of asking the font to render it again
+    TEXT_CACHE_SIZE = 256
+    
+    def __init__(self, font, color):
+        self.font = font
+        self.color = color
+        self.glyphs = dict()
+        self.texts = dict()
+        
+    def glyph(self, character):
+        glyph = self.glyphs.get(character)
+        if glyph is None:
+            advance = self.font.metrics(character)[0][4]
+            glyph = (self.font.render(character, True, self.color), advance)
+            self.glyphs[character] = glyph
+            
+        return glyph
+        
+    def render(self, text):
+        surface = self.texts.get(text)
+        if surface is not None:
+            return surface
+            
+        glyphs = [self.glyph(character) for character in text]
+        width = 0
+        for image, advance in glyphs:
+            width += advance
+            
+        surface = pygame.Surface((max(width, 1), self.font.get_height()), pygame.SRCALPHA)
+        x = 0
+        for image, advance in glyphs:
+            surface.blit(image, (x, 0))
+            x += advance
+            
+        #counters could make endless distinct strings, so don't keep them all
+        if len(self.texts) >= GlyphAtlas.TEXT_CACHE_SIZE:
+            self.texts.clear()
+            
+        self.texts[text] = surface
+        return surface
+        
+class HudText(object):
+    def __init__(self, position):
+        self.position = position
+        self.text = None
+        self.image = None
+        self.rect = None
+        self.dirty = True
+        
+class Hud(object):
+    #text drawn over the play area. Each item is only rendered when its text
+    #changes, and only redrawn when it changed or a sprite drew over it.
+    def __init__(self, font, color):
+        self.atlas = GlyphAtlas(font, color)
+        self.items = dict()
+        
+    def set(self, name, position, text):
+        item = self.items.get(name)
+        if item is None:
+            item = HudText(position)
+            self.items[name] = item
+            
+        if text != item.text:
+            item.text = text
+            item.image = self.atlas.render(text)
+            item.dirty = True
+            
+    def invalidate(self):
+        #the screen was repainted, draw everything again
+        for item in self.items.values():
+            item.dirty = True
+            
+    def draw(self, screen, background, dirty):
+        #dirty is the areas sprites drew this frame, returns the areas changed
+        changed = list()
+        for item in self.items.values():
+            if not item.dirty and item.rect.collidelist(dirty) == -1:
+                continue
+                
+            rect = item.image.get_rect(topleft=item.position)
+            if item.rect is not None:
+                #the old text might be bigger than the new
+                screen.blit(background, item.rect, item.rect)
+                changed.append(item.rect)
+                
+            screen.blit(background, rect, rect)
+            screen.blit(item.image, rect)
+            changed.append(rect)
+            item.rect = rect
+            item.dirty = False
+            
+        return changed
+        
+#high resolution wall clock in seconds
+timer = getattr(time, 'perf_counter', time.time)
+
+class FrameProfiler(object):
+    #times the phases of each frame. Call startFrame() at the top of a frame,
+    #lap(phase) at the end of each phase to charge it with the time since the
+    #previous lap, and endFrame() at the bottom. A phase that runs several
+    #times in one frame, like the steps of a slow frame, adds up. The last
+    #WINDOW frames are kept for percentiles, and if a trace filename is given
+    #every frame is also written to it as a line of json.
+    WINDOW = 300
+    PERCENTILES = (50, 95, 99)
+    
+    def __init__(self, window=WINDOW, trace=None):
+        self.frames = collections.deque(maxlen=window)
+        #phase names in the order they were first seen, for reports
+        self.phases = []
+        self.frame = None
+        self.frameCount = 0
+        self.origin = timer()
+        self.trace = open(trace, 'w') if trace is not None else None
+        
+    def startFrame(self):
+        self.frameStart = self.last = timer()
+        self.frame = dict()
+        
+    def lap(self, phase):
+        now = timer()
+        frame = self.frame
+        if frame is None:
+            return
+            
+        if phase in frame:
+            frame[phase] += now - self.last
+        else:
+            frame[phase] = now - self.last
+            if phase not in self.phases:
+                self.phases.append(phase)
+                
+        self.last = now
+        
+    def endFrame(self):
+        frame = self.frame
+        if frame is None:
+            return
+            
+        total = timer() - self.frameStart
+        self.frames.append((total, frame))
+        self.frame = None
+        
+        if self.trace is not None:
+            phases = dict((phase, elapsed * 1000.0) for phase, elapsed in frame.items())
+            self.trace.write(json.dumps({'frame': self.frameCount,
+                                         'start': (self.frameStart - self.origin) * 1000.0,
+                                         'total': total * 1000.0,
+                                         'phases': phases}) + '\n')
+        self.frameCount += 1
+        
+    def percentiles(self, phase='total'):
+        #nearest rank percentiles in ms over the window, frames that skipped
+        #the phase count as 0
+        if phase == 'total':
+            values = sorted(total for total, frame in self.frames)
+        else:
+            values = sorted(frame.get(phase, 0.0) for total, frame in self.frames)
+            
+        result = dict()
+        for percentile in FrameProfiler.PERCENTILES:
+            if values:
+                rank = int(math.ceil(percentile / 100.0 * len(values))) - 1
+                result[percentile] = values[max(rank, 0)] * 1000.0
+            else:
+                result[percentile] = 0.0
+                
+        return result
+        
+    def summary(self):
+        #{phase: {50: ms, 95: ms, 99: ms}} for every phase plus 'total'
+        summary = dict()
+        for phase in self.phases + ['total']:
+            summary[phase] = self.percentiles(phase)
+            
+        return summary
+        
+    def report(self):
+        lines = ['%-20s %8s %8s %8s' % (('phase (ms)',) + tuple('p%d' % p for p in FrameProfiler.PERCENTILES))]
+        summary = self.summary()
+        for phase in self.phases + ['total']:
+            lines.append('%-20s %8.3f %8.3f %8.3f' % ((phase,) + tuple(summary[phase][p] for p in FrameProfiler.PERCENTILES)))
+            
+        return '\n'.join(lines)
+        
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+            
+class NullProfiler(object):
+    #stands in for FrameProfiler when not profiling
+    def startFrame(self):
+        pass
+        
+    def lap(self, phase):
+        pass
+        
+    def endFrame(self):
+        pass
+        
+    def summary(self):
+        return dict()
+        
+    def close(self):
+        pass
+        
+class SilentSound(object):
+    #stands in for pygame.mixer.Sound when running headless
+    def play(self, *args, **kwargs):
+        pass
+        
+    def stop(self):
+        pass
+        
 def offscreen(sprite, screen):
     if sprite.position.x < -sprite.rect.width:
         return True
@@ -206,6 +801,14 @@ def offscreen(sprite, screen):
     if sprite.position.y > screen.get_height() + sprite.rect.height:
         return True
         
+def interpolate(sprite, alpha):
+    #place the sprite's rect between its last two simulated positions
+    if alpha >= 1.0 or sprite.previousPosition is None:
+        sprite.rect.center = sprite.position
+    else:
+        x, y = sprite.previousPosition
+        sprite.rect.center = (x + (sprite.position.x - x) * alpha, y + (sprite.position.y - y) * alpha)
+        
 def vectorApproximatelyEqual(a, b, min_delta):
     if abs(a.x - b.x) >= min_delta:
         return False
@@ -231,50 +834,152 @@ class Game(object):
     MOTORBIKE_ACCELERATION = 0.1
     TRAM_VELOCITY = 3
     TRAM_ACCELERATION = 0.025
+    #how far each track's lanes are from the middle of the screen
+    LANE_OFFSETS = {'road': 200, 'tram': 70}
     CAR_SPAWN_DELAY_AVERAGE = 1500
     DEATHS_TILL_GAME_OVER = 1
     SAVES_TILL_WIN = 20
     FONT_SIZE = 20
+    CHARACTERS = ['1', '2', '3']
+    #fraction of the screen that can change before render() flips the whole thing
+    DIRTY_AREA_LIMIT = 0.5
+    #cars and people on screen before batchCollisions uses collideBatch
+    BATCH_COLLISIONS_MIN = 150
+    FRAMES_PER_SECOND = 45
+    #all speeds, accelerations and animation lengths are per tick at this rate
+    TICKS_PER_SECOND = 45
+    TICK_TIME = 1000.0 / TICKS_PER_SECOND
+    MAX_FRAME_TIME = 250
+    #the buttons for a tick, see tick(). Held buttons are down for the whole
+    #tick, pressed ones went down since the last tick.
+    INPUT_LEFT = 1
+    INPUT_RIGHT = 2
+    INPUT_UP = 4
+    INPUT_DOWN = 8
+    INPUT_POSSESS = 16
+    INPUT_RESTART = 32
+    INPUT_PRESSED = INPUT_POSSESS | INPUT_RESTART
+    #what snapshot() leaves out: settings, the display, input and the
+    #images, sounds and text that stay the same all game
+    UNSNAPSHOTTED = ('headless', 'ticksPerSecond', 'tickTime', 'useEntityStore', 'batchCollisions', 'seed',
+                     'screen', 'background', 'winimage', 'font', 'hud', 'gameoverGroup', 'fullRedraw',
+                     'vehicleTemplates', 'splat', 'carbrakehorn', 'truckbrakehorn', 'motorbikebrakehorn', 'trambell',
+                     'profiler', 'recorder', 'buttons', 'bail')
         
-    def __init__(self):
+    def __init__(self, headless=False, ticksPerSecond=TICKS_PER_SECOND, entityStore=False, batchCollisions=False, profile=False, trace=None, seed=None, recorder=None):
+        #headless games have no window, no sound and no frame rate cap, they
+        #are stepped with simulate() rather than run(). entityStore moves
+        #walking people in one numpy batch each tick, see EntityStore.
+        #batchCollisions finds car/person overlaps with numpy when there are
+        #enough sprites for it to be quicker, see collideBatch. profile times
+        #each phase of every frame (every tick when simulating), see
+        #FrameProfiler, and trace is a file to write those timings to.
+        #seed seeds the game's own random numbers, one is picked if not given.
+        #A game is entirely decided by its seed and the buttons for each tick,
+        #on the same major version of python (their random modules differ).
+        #recorder gets the seed and every tick's buttons, see replay.py.
+        #run() closes it when the window closes, anything else driving the
+        #game with tick() has to close it when done.
+        if (entityStore or batchCollisions) and numpy is None:
+            raise ImportError("Game(entityStore=True) and Game(batchCollisions=True) need numpy")
+            
+        if profile or trace is not None:
+            self.profiler = FrameProfiler(trace=trace)
+        else:
+            self.profiler = NullProfiler()
+            
+        self.headless = headless
+        self.useEntityStore = entityStore
+        self.batchCollisions = batchCollisions
+        self.collisions = None
+        self.ticksPerSecond = ticksPerSecond
+        self.tickTime = 1000.0 / ticksPerSecond
+        if self.headless:
+            #has to happen before the display is initialised
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+            
         self.screen = pygame.display.set_mode((Game.WIDTH, Game.HEIGHT), pygame.DOUBLEBUF)
         #self.screen = pygame.display.set_mode((Game.WIDTH, Game.HEIGHT), pygame.FULLSCREEN | pygame.DOUBLEBUF | pygame.HWSURFACE)
         
-        pygame.mixer.init()
-        self.splat = pygame.mixer.Sound("sound/splat.ogg")
-        self.carbrakehorn = pygame.mixer.Sound("sound/carbrakehorn.ogg")
-        self.truckbrakehorn = pygame.mixer.Sound("sound/truckbrakehorn.ogg")
-        self.motorbikebrakehorn = pygame.mixer.Sound("sound/motorbikebrakehorn.ogg")
-        self.trambell = pygame.mixer.Sound("sound/trambell.ogg")
+        if not self.headless:
+            pygame.mixer.init()
+            pygame.mixer.music.load("sound/ghostsquishies.ogg")
+            
+        self.splat = self.loadSound("sound/splat.ogg")
+        self.carbrakehorn = self.loadSound("sound/carbrakehorn.ogg")
+        self.truckbrakehorn = self.loadSound("sound/truckbrakehorn.ogg")
+        self.motorbikebrakehorn = self.loadSound("sound/motorbikebrakehorn.ogg")
+        self.trambell = self.loadSound("sound/trambell.ogg")
+        
+        #simulation time in ms and steps taken, advanced by step()
+        self.simTime = 0
+        self.tickCount = 0
+        
+        if seed is None:
+            seed = random.randrange(1 << 32)
+        self.seed = seed
+        self.random = random.Random(seed)
         
-        pygame.mixer.music.load("sound/ghostsquishies.ogg")
+        #buttons for the next tick, gathered by processInput()
+        self.buttons = 0
         
         pygame.font.init()
         self.font = pygame.font.Font("Profaisal-EliteRiqaV1.0.ttf", Game.FONT_SIZE)
+        self.hud = Hud(self.font, pygame.Color("white"))
         
-        self.background = pygame.image.load("images/background.png")
+        self.background = loadImage("images/background.png", opaque=True)
         
-        self.carimage = pygame.image.load('images/car.png')
-        self.truckimage = pygame.image.load('images/truck.png')
-        self.motorbikeimage = pygame.image.load('images/motorbike.png')
-        self.tramimage = pygame.image.load('images/tram.png')
+        self.vehicleTemplates = [
+            VehicleTemplate('car', loadImage('images/car.png'), Game.CAR_VELOCITY, Game.CAR_ACCELERATION, self.carbrakehorn, 'road'),
+            VehicleTemplate('truck', loadImage('images/truck.png'), Game.TRUCK_VELOCITY, Game.TRUCK_ACCELERATION, self.truckbrakehorn, 'road'),
+            VehicleTemplate('motorbike', loadImage('images/motorbike.png'), Game.MOTORBIKE_VELOCITY, Game.MOTORBIKE_ACCELERATION, self.motorbikebrakehorn, 'road'),
+            VehicleTemplate('tram', loadImage('images/tram.png'), Game.TRAM_VELOCITY, Game.TRAM_ACCELERATION, self.trambell, 'tram')]
+        
+        #load everything that gets spawned up front, not mid frame
+        loadImage('images/player.png')
+        for character in Game.CHARACTERS:
+            for filename in personImages(character):
+                loadImage(filename)
         
         gameoversprite = pygame.sprite.DirtySprite()
-        gameoversprite.image = pygame.image.load('images/gameover.png')
+        gameoversprite.image = loadImage('images/gameover.png')
         gameoversprite.rect = pygame.Rect(0, 0, gameoversprite.image.get_width(), gameoversprite.image.get_height())
         gameoversprite.rect.center = (gameoversprite.image.get_width() / 2 + 50, gameoversprite.image.get_height() / 2 + 50)
         self.gameoverGroup = pygame.sprite.RenderUpdates([gameoversprite])
         
-        self.winimage = pygame.image.load('images/win.png')
+        self.winimage = loadImage('images/win.png', opaque=True)
         
         self.carsSpawnDelay = Game.CAR_SPAWN_DELAY_AVERAGE
         self.bail = False
         
+        self.recorder = recorder
         self.reset()
         
+        if self.recorder is not None:
+            self.recorder.start(self)
+            
+    def loadSound(self, filename):
+        if self.headless:
+            return SilentSound()
+            
+        return pygame.mixer.Sound(filename)
+        
     def reset(self):
+        #the game that just ended goes into the recording now rather than
+        #waiting for the recorder to be closed
+        if self.recorder is not None:
+            self.recorder.flush()
+            
         self.carGroup = pygame.sprite.RenderUpdates()
-        self.crashPredictGroup = pygame.sprite.RenderUpdates()
+        self.carGrid = SpatialGrid()
+        
+        #one lane each way for road traffic and for trams
+        self.lanes = dict()
+        for track in Game.LANE_OFFSETS:
+            for direction in (1, -1):
+                self.lanes[(track, direction)] = Lane(direction)
+                
         self.carSpawnLast = 0
         
         self.player = Player('images/player.png')
@@ -283,118 +988,316 @@ class Game(object):
         
         self.people = list()
         self.personGroup = pygame.sprite.RenderUpdates(self.people)
+        self.personGrid = SpatialGrid()
+        
+        if self.useEntityStore:
+            self.entityStore = EntityStore()
+        else:
+            self.entityStore = None
         
         self.possessToggle = False
         self.gameover = False
         
         self.peopleSaved = 0
         self.concurrentPeople = 1
-        self.lastDifficultyIncrease = pygame.time.get_ticks()
+        self.lastDifficultyIncrease = self.simTime
         
         self.screen.blit(self.background, (0, 0))
-        pygame.mixer.music.play(-1)
+        self.hud.invalidate()
+        self.fullRedraw = True
+        if not self.headless:
+            pygame.mixer.music.play(-1)
     
     def run(self):      
         clock = pygame.time.Clock()
+        profiler = self.profiler
+        
+        #time not yet simulated, carried over between frames
+        accumulator = 0.0
         
         self.bail = False
         while not self.bail:
-            elapsed = clock.tick(45)
-            #if elapsed > 20:
-            #    print("frametime drop:%(elapsed)03d" % {'elapsed': elapsed})
-            
-            now = pygame.time.get_ticks()
-            if now - self.lastDifficultyIncrease > Game.SPAWN_PEOPLE_INCREASE_TIME * self.concurrentPeople:
-                self.lastDifficultyIncrease = now
-                self.concurrentPeople += 1
+            profiler.startFrame()
+            elapsed = clock.tick(Game.FRAMES_PER_SECOND)
+            profiler.lap('wait')
             
             #input
             self.processInput()
+            profiler.lap('processInput')
             
-            if self.peopleSaved >= Game.SAVES_TILL_WIN:
-                self.gameover = True
-                while self.gameover and (not self.bail):
+            #run as many fixed length ticks as fit in the time since the last
+            #frame, a slow frame means more ticks rather than slower traffic.
+            #Presses only count for the first tick after them.
+            accumulator += min(elapsed, Game.MAX_FRAME_TIME)
+            while accumulator >= self.tickTime:
+                self.tick(self.buttons)
+                self.buttons &= ~Game.INPUT_PRESSED
+                accumulator -= self.tickTime
+                
+            #step() decides the game is won, this only shows it, before the
+            #won game is ever drawn. The restart is a tick like any other
+            #input, run straight away so the next frame is the new game.
+            if self.gameover and self.peopleSaved >= Game.SAVES_TILL_WIN:
+                while not self.buttons & Game.INPUT_RESTART and not self.bail:
                     clock.tick(10)
                     self.screen.blit(self.winimage, (0, 0))
                     pygame.display.flip()
                     self.processInput()
                     
-                continue
+                if self.bail:
+                    break
                     
-            #sim
-            self.spawnPeople()
-            self.spawnCars()
-            
-            self.carGroup.update()
-            self.playerGroup.update()
-            self.personGroup.update()
-            self.crashPredictGroup.update()
-            
-            self.runCars()
-            self.runPeople()
-            self.runPlayer()
-            
-            dead = 0
-            for person in self.personGroup:
-                dead += 1 if person.dead else 0
+                self.tick(self.buttons)
+                self.buttons &= ~Game.INPUT_PRESSED
+                accumulator = 0.0
                 
-            if dead >= Game.DEATHS_TILL_GAME_OVER:
-                self.gameover = True
-            
-            #render
-            self.personGroup.clear(self.screen, self.background)
-            self.carGroup.clear(self.screen, self.background)
-            self.playerGroup.clear(self.screen, self.background)
-            #self.crashPredictGroup.clear(self.screen, self.background) #debug only
-            
-            self.personGroup.draw(self.screen)
-            self.carGroup.draw(self.screen)
-            self.playerGroup.draw(self.screen)
-            #self.crashPredictGroup.draw(self.screen) #debug only
-            fontsurf = self.font.render("Saved %(saved)d / %(savesTillWin)d" % {'saved': self.peopleSaved, 'savesTillWin' : Game.SAVES_TILL_WIN}, True, pygame.Color("white"))
-            self.screen.blit(self.background, (0, 0), fontsurf.get_rect())
-            self.screen.blit(fontsurf, (0, 0))
-            
-            if self.gameover:
-                pygame.mixer.music.stop()
-                self.gameoverGroup.draw(self.screen)
-            
-            pygame.display.flip()
+            self.render(accumulator / self.tickTime)
+            profiler.endFrame()
+        
+        if isinstance(profiler, FrameProfiler):
+            print(profiler.report())
+        profiler.close()
+        if self.recorder is not None:
+            self.recorder.close()
         
         #clean up before exit
         pygame.display.quit()
         pygame.mixer.quit()
         pygame.font.quit()
         
+    def simulate(self, ticks):
+        #run up to ticks simulation steps as fast as possible, with no input
+        #handling or rendering. Steer the player with steerPlayer() and
+        #possessToggle between calls, or use tick() instead. Returns the
+        #number of ticks stepped, which is less than ticks if the game ended.
+        for tick in range(ticks):
+            if self.gameover:
+                return tick
+                
+            self.profiler.startFrame()
+            self.step(self.tickTime)
+            self.profiler.endFrame()
+            
+        return ticks
+        
+    def tick(self, buttons):
+        #one lockstep tick: apply the buttons, a Game.INPUT_ bitmask, then
+        #step. Replaying the same buttons for every tick of a game with the
+        #same seed replays the game exactly.
+        if self.recorder is not None:
+            self.recorder.record(buttons)
+            
+        if buttons & Game.INPUT_RESTART and self.gameover:
+            self.reset()
+            
+        if self.gameover:
+            self.steerPlayer(False, False, False, False)
+        else:
+            self.steerPlayer(buttons & Game.INPUT_LEFT, buttons & Game.INPUT_RIGHT,
+                             buttons & Game.INPUT_UP, buttons & Game.INPUT_DOWN)
+            if buttons & Game.INPUT_POSSESS:
+                self.possessToggle = True
+                
+        self.step(self.tickTime)
+        
+    def snapshot(self):
+        #a copy of the simulation state to restore() later. Images, sounds
+        #and the display are shared with the game rather than copied, so a
+        #snapshot only lasts as long as the game it came from.
+        state = dict((name, value) for name, value in vars(self).items() if name not in Game.UNSNAPSHOTTED)
+        return copy.deepcopy(state, self.sharedObjects())
+        
+    def restore(self, snapshot):
+        #go back to a snapshot, which can be restored again later
+        self.__dict__.update(copy.deepcopy(snapshot, self.sharedObjects()))
+        self.screen.blit(self.background, (0, 0))
+        self.hud.invalidate()
+        self.fullRedraw = True
+        
+    def sharedObjects(self):
+        #deepcopy memo that makes copies keep the same images and sounds
+        shared = [getattr(self, name) for name in Game.UNSNAPSHOTTED if hasattr(self, name)]
+        shared.extend(imageCache.values())
+        for rotations in rotationCache.values():
+            shared.extend(rotations)
+            
+        for frames in Player.animations.values():
+            for images in frames:
+                shared.extend(images)
+                
+        for template in self.vehicleTemplates:
+            shared.append(template)
+            shared.extend(template.images.values())
+            
+        return dict((id(thing), thing) for thing in shared)
+        
+    def step(self, dt):
+        #advance the simulation by dt milliseconds
+        profiler = self.profiler
+        self.simTime += dt
+        self.tickCount += 1
+        scale = dt / Game.TICK_TIME
+        
+        now = self.simTime
+        if now - self.lastDifficultyIncrease > Game.SPAWN_PEOPLE_INCREASE_TIME * self.concurrentPeople:
+            self.lastDifficultyIncrease = now
+            self.concurrentPeople += 1
+            
+        self.spawnPeople()
+        profiler.lap('spawnPeople')
+        self.spawnCars(scale)
+        profiler.lap('spawnCars')
+        
+        #remember where everything was for render interpolation
+        if not self.headless:
+            for group in (self.carGroup, self.playerGroup, self.personGroup):
+                for sprite in group:
+                    if sprite.previousPosition is None:
+                        sprite.previousPosition = sprite.position.copy()
+                    else:
+                        sprite.previousPosition.set(sprite.position.x, sprite.position.y)
+            profiler.lap('previousPosition')
+        
+        #the player moves its host, so it has to go between cars and people
+        self.carGroup.update(scale)
+        profiler.lap('carGroup.update')
+        self.playerGroup.update(scale)
+        profiler.lap('playerGroup.update')
+        if self.entityStore is None:
+            self.personGroup.update(scale)
+        else:
+            self.entityStore.movePeople(scale)
+        profiler.lap('personGroup.update')
+        
+        for lane in self.lanes.values():
+            lane.reorder()
+            
+        for car in self.carGroup:
+            self.carGrid.move(car)
+            
+        for person in self.personGroup:
+            self.personGrid.move(person)
+        profiler.lap('spatial')
+            
+        #the grids are quicker until there are a lot of sprites
+        if self.batchCollisions and len(self.carGroup) + len(self.personGroup) >= Game.BATCH_COLLISIONS_MIN:
+            self.collisions = collideBatch(self.carGroup.sprites(), self.personGroup.sprites())
+            profiler.lap('collideBatch')
+        else:
+            self.collisions = None
+        
+        self.runCars(scale)
+        profiler.lap('runCars')
+        self.runPeople()
+        profiler.lap('runPeople')
+        self.runPlayer()
+        profiler.lap('runPlayer')
+        
+        dead = 0
+        for person in self.personGroup:
+            dead += 1 if person.dead else 0
+            
+        #winning ends the game here too, so a replay ends and restarts where
+        #the recorded game did
+        if dead >= Game.DEATHS_TILL_GAME_OVER or self.peopleSaved >= Game.SAVES_TILL_WIN:
+            self.gameover = True
+        profiler.lap('gameover')
+            
+    def render(self, alpha=1.0):
+        #alpha is how far between the last two simulation steps to draw things
+        profiler = self.profiler
+        if alpha < 1.0:
+            for group in (self.carGroup, self.playerGroup, self.personGroup):
+                for sprite in group:
+                    interpolate(sprite, alpha)
+        profiler.lap('interpolate')
+                    
+        self.personGroup.clear(self.screen, self.background)
+        self.carGroup.clear(self.screen, self.background)
+        self.playerGroup.clear(self.screen, self.background)
+        profiler.lap('clear')
+        
+        #draw returns the areas that changed, old and new sprite positions
+        dirty = self.personGroup.draw(self.screen)
+        dirty.extend(self.carGroup.draw(self.screen))
+        dirty.extend(self.playerGroup.draw(self.screen))
+        #for car in self.carGroup: pygame.draw.rect(self.screen, (255, 0, 0), car.crashPredictor.rect, 1) #debug only
+        profiler.lap('draw')
+        self.hud.set('saved', (0, 0), "Saved %(saved)d / %(savesTillWin)d" % {'saved': self.peopleSaved, 'savesTillWin' : Game.SAVES_TILL_WIN})
+        dirty.extend(self.hud.draw(self.screen, self.background, dirty))
+        profiler.lap('hud')
+        
+        if self.gameover:
+            if not self.headless:
+                pygame.mixer.music.stop()
+            dirty.extend(self.gameoverGroup.draw(self.screen))
+            profiler.lap('draw')
+            
+        self.updateDisplay(dirty)
+        profiler.lap('flip')
+        
+        #back to the simulated positions for collision checks
+        if alpha < 1.0:
+            for group in (self.carGroup, self.playerGroup, self.personGroup):
+                for sprite in group:
+                    interpolate(sprite, 1.0)
+        profiler.lap('interpolate')
+        
+    def updateDisplay(self, dirty):
+        #push only the changed areas to the display, unless so much changed
+        #that a full flip is cheaper
+        area = 0
+        for rect in dirty:
+            area += rect.width * rect.height
+            
+        if self.fullRedraw or area > Game.DIRTY_AREA_LIMIT * Game.WIDTH * Game.HEIGHT:
+            self.fullRedraw = False
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
+            
     def runPeople(self):
         for person in self.people:
             if not person.dead:
-                collisions = pygame.sprite.spritecollide(person, self.carGroup, False)
+                collisions = self.carsOn(person)
                 if len(collisions) > 0:
                     for car in collisions:
                         if car.velocity.magnitude() > 1.0:
                             person.kill()
+                            
+                    if person.dead and self.entityStore is not None:
+                        self.entityStore.people.remove(person)
                 elif offscreen(person, self.screen):
                     self.personGroup.remove(person)
+                    self.personGrid.remove(person)
+                    if self.entityStore is not None:
+                        self.entityStore.people.remove(person)
                     self.people.remove(person)
                     if not self.gameover:
                         self.peopleSaved += 1
             else:
                 pass
             
-    def runCars(self):
+    def runCars(self, scale=1.0):
         for car in self.carGroup.sprites():
             if offscreen(car, self.screen):
                 self.carGroup.remove(car)
+                self.carGrid.remove(car)
+                car.lane.remove(car)
+                continue
                 
             #slow down if there's an obstacle ahead
-            collisions = pygame.sprite.spritecollide(car.crashPredictor, self.carGroup, False)
-            collisions.extend(pygame.sprite.spritecollide(car.crashPredictor, self.personGroup, False))
+            collisions = list()
+            obstruction = car.crashPredictor.obstruction()
+            if obstruction is not None:
+                collisions.append(obstruction)
+                
+            collisions.extend(self.peopleAhead(car))
             
             braked = False
             
-            if len(collisions) > 0 and ((collisions[0] is not car) or (len(collisions) > 1)):
-                car.brake(collisions)
+            if len(collisions) > 0:
+                car.brake(collisions, scale)
                 braked = True
                 #don't brake for dead people
                 #print(collisions)
@@ -405,13 +1308,26 @@ class Game(object):
             
             
             if (not braked) and (car.velocity.magnitude() < car.maxVelocity):
-                car.accelerate()
+                car.accelerate(scale)
                 
             
+    def peopleAhead(self, car):
+        if self.collisions is None:
+            return self.personGrid.collide(car.crashPredictor)
+            
+        return self.collisions[0].get(car, [])
+        
+    def carsOn(self, person):
+        if self.collisions is None:
+            return self.carGrid.collide(person)
+            
+        #cars that left the screen this tick are gone
+        return [car for car in self.collisions[1].get(person, []) if car.alive()]
+        
     def runPlayer(self):
         if self.possessToggle:
             if self.player.host is None:
-                collisions = pygame.sprite.spritecollide(self.player, self.personGroup, False)
+                collisions = self.personGrid.collide(self.player)
                 if len(collisions) > 0:
                     self.player.possess(collisions[0])
                 else:
@@ -436,85 +1352,79 @@ class Game(object):
             
     def spawnPerson(self):
         #randomly choose top or bottom for y
-        y = random.choice([0, self.screen.get_height()])
+        y = self.random.choice([0, self.screen.get_height()])
         goalY = self.screen.get_height() + 100 if y == 0 else -100
         
         #pick random x value
-        x = random.randint(200, self.screen.get_width() - 200)
+        x = self.random.randint(200, self.screen.get_width() - 200)
         
         #spawn person at x y
-        character = random.choice(['1', '2', '3'])
-        stand = 'images/person' + character + '.png'
-        stepLeft = 'images/personstepleft' + character + '.png'
-        stepRight = 'images/personstepright' + character + '.png'
-        dead = 'images/deadperson' + character + '.png'
+        character = self.random.choice(Game.CHARACTERS)
+        stand, stepLeft, stepRight, dead = personImages(character)
         person = Person(stand, stepLeft, stepRight, dead, self.splat)
         person.position = euclid.Vector2(x, y)
         person.goal = euclid.Vector2(x, goalY)
         self.people.append(person)
         self.personGroup.add(person)
+        self.personGrid.add(person)
+        if self.entityStore is not None:
+            self.entityStore.people.add(person)
         
-    def spawnCars(self):
-        now = pygame.time.get_ticks()
+    def spawnCars(self, scale=1.0):
+        #scale is the step length, as in Vehicle.update, so a new vehicle's
+        #first move is as far as it would go in any other step
+        now = self.simTime
         elapsed = now - self.carSpawnLast
         if elapsed < self.carsSpawnDelay:
             return
         
-        self.carsSpawnDelay = Game.CAR_SPAWN_DELAY_AVERAGE + random.randint(-500, +500)
+        self.carsSpawnDelay = Game.CAR_SPAWN_DELAY_AVERAGE + self.random.randint(-500, +500)
         self.carSpawnLast = now
         
         if len(self.carGroup.sprites()) < Game.SPAWN_CARS_BELOW:
             #car or truck?
-            vehicleType = random.choice(['car', 'truck', 'motorbike', 'tram'])
-            if vehicleType == 'car':
-                wheels = Vehicle(self.carimage, Game.CAR_VELOCITY, self.carbrakehorn, Game.CAR_ACCELERATION)
-            elif vehicleType == 'truck':
-                wheels = Vehicle(self.truckimage, Game.TRUCK_VELOCITY, self.truckbrakehorn, Game.TRUCK_ACCELERATION)
-            elif vehicleType == 'motorbike':
-                wheels = Vehicle(self.motorbikeimage, Game.MOTORBIKE_VELOCITY, self.motorbikebrakehorn, Game.MOTORBIKE_ACCELERATION)
-            else:
-                wheels = Vehicle(self.tramimage, Game.TRAM_VELOCITY, self.trambell, Game.TRAM_ACCELERATION)
+            template = self.random.choice(self.vehicleTemplates)
             
             #pick a random side (left or right)
-            x = random.choice([-100, self.screen.get_width() + 100])
-            y = self.screen.get_height() / 2
-            
-            if x <= 0:
-                xVelocity = wheels.maxVelocity
-                y += -200 if vehicleType != 'tram' else -70
-            else:
-                xVelocity = -wheels.maxVelocity
-                y += 200 if vehicleType != 'tram' else 70
-                wheels.image = pygame.transform.flip(wheels.image, True, False)
+            x = self.random.choice([-100, self.screen.get_width() + 100])
+            direction = 1 if x <= 0 else -1
+            y = self.screen.get_height() / 2 + Game.LANE_OFFSETS[template.track] * -direction
             
-            wheels.velocity = euclid.Vector2(xVelocity, 0)
+            #see if the back of the lane is still occupied where the vehicle
+            #would be after its first move, if so, do nothing
+            lane = self.lanes[(template.track, direction)]
+            last = lane.last()
+            if last is not None:
+                rect = template.images[direction].get_rect()
+                rect.center = (x + template.maxVelocity * direction * scale, y)
+                if rect.colliderect(last.rect):
+                    return
+                    
+            wheels = Vehicle(template, direction)
             wheels.position = euclid.Vector2(x, y)
-            wheels.update()
-            
-            #see if there is another (non-dead) sprite occupying the space, if so, do nothing
-            collisions = pygame.sprite.spritecollide(wheels, self.carGroup, False)
-            if len(collisions) == 0:
-                self.carGroup.add(wheels)
-                self.crashPredictGroup.add(wheels.crashPredictor)
-            else:
-                wheels.crashPredictor.vehicle = None
-                wheels.crashPredictor = None
+            wheels.update(scale)
+            self.carGroup.add(wheels)
+            self.carGrid.add(wheels)
+            lane.add(wheels)
         
     def processInput(self):
+        #gather the buttons for the next tick, presses not yet used by a tick
+        #are kept
+        buttons = self.buttons & Game.INPUT_PRESSED
         for event in pygame.event.get():
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.bail = True
                     break
                 elif event.key == pygame.K_SPACE and not self.gameover:
-                    self.possessToggle = True
+                    buttons |= Game.INPUT_POSSESS
                 elif event.key == pygame.K_RETURN and self.gameover:
-                    self.reset()
+                    buttons |= Game.INPUT_RESTART
                 else:
                     pass
             elif event.type == pygame.KEYUP:
                 if event.key == pygame.K_SPACE:
-                    self.possessToggle = False
+                    buttons &= ~Game.INPUT_POSSESS
                 else:
                     pass
             elif event.type == pygame.QUIT:
@@ -525,24 +1435,46 @@ class Game(object):
                 
         pygame.event.clear()
         
-        self.player.direction = euclid.Vector2(0, 0)
+        pressed = pygame.key.get_pressed()
+        if pressed[pygame.K_a] or pressed[pygame.K_LEFT]:
+            buttons |= Game.INPUT_LEFT
+        if pressed[pygame.K_d] or pressed[pygame.K_RIGHT]:
+            buttons |= Game.INPUT_RIGHT
+        if pressed[pygame.K_w] or pressed[pygame.K_UP]:
+            buttons |= Game.INPUT_UP
+        if pressed[pygame.K_s] or pressed[pygame.K_DOWN]:
+            buttons |= Game.INPUT_DOWN
+            
+        self.buttons = buttons
         
-        if self.gameover:
-            return
+    def steerPlayer(self, left, right, up, down):
+        #set the player direction for the next step, keeping them on screen
+        self.player.direction.set(0, 0)
         
-        pressed = pygame.key.get_pressed()
-        if (pressed[pygame.K_a] or pressed[pygame.K_LEFT]) and self.player.position.x > 0:
+        if left and self.player.position.x > 0:
             self.player.direction.x -= 1
             
-        if (pressed[pygame.K_d] or pressed[pygame.K_RIGHT]) and self.player.position.x < self.screen.get_width():
+        if right and self.player.position.x < self.screen.get_width():
             self.player.direction.x += 1
             
-        if (pressed[pygame.K_w] or pressed[pygame.K_UP]) and self.player.position.y > 0:
+        if up and self.player.position.y > 0:
             self.player.direction.y -= 1
             
-        if (pressed[pygame.K_s] or pressed[pygame.K_DOWN]) and self.player.position.y < self.screen.get_height():
+        if down and self.player.position.y < self.screen.get_height():
             self.player.direction.y += 1
                 
 
 if __name__ == '__main__':
-    Game().run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Ghost Safety Squad')
+    parser.add_argument('--profile', action='store_true', help='print frame time percentiles for each phase on exit')
+    parser.add_argument('--trace', metavar='FILE', help='write every frame\'s phase timings to FILE as json lines')
+    parser.add_argument('--seed', type=int, help='seed for the game\'s random numbers')
+    parser.add_argument('--record', metavar='FILE', help='record the game to FILE, play it back with replay.py')
+    options = parser.parse_args()
+    
+    recorder = None
+    if options.record:
+        import replay
+        recorder = replay.Recorder(open(options.record, 'wb'))
+        
+    Game(profile=options.profile, trace=options.trace, seed=options.seed, recorder=recorder).run()
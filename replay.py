@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2012  Daniel Kinsman
+# danielkinsman+gss@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#recording and replaying games. A game is decided by its seed and the
+#buttons for each tick (see Game.tick), so that is all a recording holds:
+#a header, then runs of identical ticks as a buttons byte followed by the
+#run length as a varint. An hour of play is typically a few kilobytes.
+#
+#record with "game.py --record FILE", play back headless and as fast as
+#possible with "replay.py FILE". --profile and --trace time every tick like
+#game.py does, to chase down slow frames, and --to stops at a tick so the
+#game can be looked at there. Replay.seek() jumps about in a long game by
+#starting from the nearest snapshot taken on the way through.
+#
+#"replay.py --check" records a headless game that wins and restarts a few
+#times, replays it and fails unless both end up the same.
+
+import argparse
+import io
+import os
+import struct
+import sys
+
+import benchmark
+import game
+
+MAGIC = b'GSSR'
+VERSION = 1
+#magic, version, python major version, flags, ticks per second, seed
+HEADER = struct.Struct('<4sBBBdq')
+FLAG_ENTITY_STORE = 1
+FLAG_BATCH_COLLISIONS = 2
+
+class RecordingError(Exception):
+    pass
+
+def writeVarint(output, value):
+    #7 bits at a time, low bits first, high bit set on all but the last byte
+    data = bytearray()
+    while value > 0x7f:
+        data.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    data.append(value)
+    output.write(bytes(data))
+
+class Recorder(object):
+    #writes a game to a file as it is played. Give it to Game(recorder=),
+    #which calls start() once, record() every tick and flush() on every
+    #restart. Game.run() calls close() at the end. Anything driving the game
+    #with tick() has to close() it, or flush() it before reading the output,
+    #or the last run of ticks is lost.
+    def __init__(self, output):
+        self.output = output
+        self.buttons = None
+        self.count = 0
+
+    def start(self, game):
+        flags = 0
+        if game.useEntityStore:
+            flags |= FLAG_ENTITY_STORE
+        if game.batchCollisions:
+            flags |= FLAG_BATCH_COLLISIONS
+
+        self.output.write(HEADER.pack(MAGIC, VERSION, sys.version_info[0], flags, game.ticksPerSecond, game.seed))
+
+    def record(self, buttons):
+        if buttons == self.buttons:
+            self.count += 1
+            return
+
+        self.flush()
+        self.buttons = buttons
+        self.count = 1
+
+    def flush(self):
+        #write out the current run
+        if self.count > 0:
+            self.output.write(struct.pack('<B', self.buttons))
+            writeVarint(self.output, self.count)
+            self.count = 0
+
+    def close(self):
+        self.flush()
+        self.output.close()
+
+class Recording(object):
+    #a recording read back from a file
+    def __init__(self, input):
+        data = bytearray(input.read())
+        if len(data) < HEADER.size or bytes(data[:len(MAGIC)]) != MAGIC:
+            raise RecordingError('not a recording')
+
+        magic, version, self.pythonVersion, flags, self.ticksPerSecond, self.seed = HEADER.unpack_from(bytes(data[:HEADER.size]))
+        if version != VERSION:
+            raise RecordingError('recording version %d, expected %d' % (version, VERSION))
+
+        self.entityStore = bool(flags & FLAG_ENTITY_STORE)
+        self.batchCollisions = bool(flags & FLAG_BATCH_COLLISIONS)
+
+        #one byte of buttons per tick
+        self.buttons = bytearray()
+        offset = HEADER.size
+        while offset < len(data):
+            buttons = data[offset]
+            offset += 1
+            count = 0
+            shift = 0
+            while True:
+                if offset >= len(data):
+                    raise RecordingError('recording is cut short')
+
+                byte = data[offset]
+                offset += 1
+                count |= (byte & 0x7f) << shift
+                shift += 7
+                if not byte & 0x80:
+                    break
+
+            self.buttons.extend(bytearray([buttons]) * count)
+
+    def __len__(self):
+        return len(self.buttons)
+
+class Replay(object):
+    #plays a recording back in a headless game. With snapshotInterval set, a
+    #snapshot is kept every that many ticks on the way through, so seek()
+    #back, or forward past somewhere already played, only has to simulate
+    #from the nearest one. Without, seeking back starts from the beginning.
+    def __init__(self, recording, snapshotInterval=None, profile=False, trace=None):
+        if recording.pythonVersion != sys.version_info[0]:
+            #the random module differs, so spawns won't match
+            sys.stderr.write('warning: recorded on python %d, this is python %d, the replay will differ\n' %
+                             (recording.pythonVersion, sys.version_info[0]))
+
+        self.recording = recording
+        self.snapshotInterval = snapshotInterval
+        self.game = game.Game(headless=True, ticksPerSecond=recording.ticksPerSecond,
+                              entityStore=recording.entityStore, batchCollisions=recording.batchCollisions,
+                              profile=profile, trace=trace, seed=recording.seed)
+        #tick number: snapshot taken before that tick
+        self.snapshots = {0: self.game.snapshot()}
+
+    def advance(self, ticks=None):
+        #play up to ticks more ticks, or to the end. Returns the ticks played.
+        buttons = self.recording.buttons
+        start = self.game.tickCount
+        end = len(buttons) if ticks is None else min(start + ticks, len(buttons))
+        interval = self.snapshotInterval
+        profiler = self.game.profiler
+        for tick in range(start, end):
+            if interval and tick % interval == 0 and tick not in self.snapshots:
+                self.snapshots[tick] = self.game.snapshot()
+
+            #each tick is a frame to the profiler, like Game.simulate
+            profiler.startFrame()
+            self.game.tick(buttons[tick])
+            profiler.endFrame()
+
+        return end - start
+
+    def seek(self, tick):
+        #get to just before tick, by way of the nearest snapshot before it if
+        #that saves simulating
+        tick = min(tick, len(self.recording))
+        nearest = max([taken for taken in self.snapshots if taken <= tick])
+        if tick < self.game.tickCount or nearest > self.game.tickCount:
+            self.game.restore(self.snapshots[nearest])
+
+        self.advance(tick - self.game.tickCount)
+
+def state(g):
+    #what has to match between a game and its replay
+    return (g.tickCount, g.peopleSaved, g.gameover, tuple(g.player.position),
+            sorted((car.position.x, car.position.y, car.velocity.x) for car in g.carGroup),
+            [(person.position.x, person.position.y, person.dead) for person in g.people])
+
+def check(seed, ticks, savesTillWin=1):
+    #record a headless game, played by benchmark's scripted player with a
+    #restart as soon as each game ends, then replay the recording and
+    #compare. A win has to happen so that a restart after one is covered.
+    #Returns a list of failures.
+    failures = []
+    oldSaves = game.Game.SAVES_TILL_WIN
+    game.Game.SAVES_TILL_WIN = savesTillWin
+    try:
+        output = io.BytesIO()
+        recorder = Recorder(output)
+        g = game.Game(headless=True, seed=seed, recorder=recorder)
+        wins = 0
+        for tick in range(ticks):
+            buttons = benchmark.scriptedButtons(g)
+            if g.gameover:
+                buttons |= game.Game.INPUT_RESTART
+                dead = sum(1 for person in g.people if person.dead)
+                if dead < game.Game.DEATHS_TILL_GAME_OVER:
+                    wins += 1
+
+            g.tick(buttons)
+
+        recorder.flush()
+        if wins == 0:
+            failures.append('never won in %d ticks' % ticks)
+
+        recording = Recording(io.BytesIO(output.getvalue()))
+        if len(recording) != ticks:
+            failures.append('recorded %d ticks, played %d' % (len(recording), ticks))
+
+        replay = Replay(recording)
+        replay.advance()
+        if state(replay.game) != state(g):
+            failures.append('replay ends at tick %d with %d saved, the game at tick %d with %d saved' % (
+                replay.game.tickCount, replay.game.peopleSaved, g.tickCount, g.peopleSaved))
+    finally:
+        game.Game.SAVES_TILL_WIN = oldSaves
+
+    return failures
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Play back a Ghost Safety Squad recording headless')
+    parser.add_argument('recording', metavar='FILE', nargs='?', help='recorded with game.py --record')
+    parser.add_argument('--to', type=int, metavar='TICK', help='stop before this tick')
+    parser.add_argument('--snapshot-every', dest='snapshotInterval', type=int, metavar='TICKS', help='keep a snapshot every TICKS ticks')
+    parser.add_argument('--profile', action='store_true', help='print tick time percentiles for each phase')
+    parser.add_argument('--trace', metavar='FILE', help='write every tick\'s phase timings to FILE as json lines')
+    parser.add_argument('--check', action='store_true', help='record and replay a game that wins and restarts, instead of FILE')
+    parser.add_argument('--seed', type=int, default=1, help='seed for --check, default 1')
+    parser.add_argument('--ticks', type=int, default=5000, help='ticks for --check, default 5000')
+    options = parser.parse_args(args)
+    if options.recording is None and not options.check:
+        parser.error('a recording or --check is needed')
+
+    #the game loads its fonts, images and sounds relative to its directory
+    if options.recording is not None:
+        options.recording = os.path.abspath(options.recording)
+    if options.trace is not None:
+        options.trace = os.path.abspath(options.trace)
+    os.chdir(os.path.dirname(os.path.abspath(game.__file__)))
+
+    if options.check:
+        failures = check(options.seed, options.ticks)
+        for failure in failures:
+            print('FAIL %s' % failure)
+        if failures:
+            sys.exit(1)
+
+        print('recording round trip ok')
+        return
+
+    with open(options.recording, 'rb') as input:
+        recording = Recording(input)
+
+    print('seed %d, %d ticks (%.1f s), recorded on python %d' % (recording.seed, len(recording),
+                                                                len(recording) / recording.ticksPerSecond,
+                                                                recording.pythonVersion))
+
+    replay = Replay(recording, options.snapshotInterval, options.profile, options.trace)
+    start = game.timer()
+    if options.to is None:
+        replay.advance()
+    else:
+        replay.seek(options.to)
+    elapsed = game.timer() - start
+
+    g = replay.game
+    dead = sum(1 for person in g.people if person.dead)
+    print('tick %d in %.2f s (%.0f ticks/s): saved %d, dead %d, people %d, cars %d%s' % (
+        g.tickCount, elapsed, g.tickCount / max(elapsed, 1e-9), g.peopleSaved, dead,
+        len(g.people), len(g.carGroup), ', game over' if g.gameover else ''))
+
+    if options.profile:
+        print(g.profiler.report())
+    g.profiler.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])